@@ -1,27 +1,24 @@
 #!/usr/bin/python3 -OO
 '''
 Intelligently disassemble and reassemble MIPS binaries
+
+Importing this module sets nothing up: the tables are filled in by
+init(), which the commands call on first use, as should callers of the
+lower-level functions. The command line is handled by main().
+
+>>> init()
 '''
 from __future__ import print_function
-import sys, os, struct, ctypes, re, logging, pdb
+import sys, os, struct, ctypes, re, logging, mmap, time, ast, zlib
+import marshal, hashlib, io, json, socket, signal, stat
+import builtins
+import importlib.util
 from collections import OrderedDict, defaultdict
-from ctypes import c_byte, c_int16, c_int32, c_int64
+from itertools import islice
+from array import array
+from functools import partial
+from operator import itemgetter
 
-logging.basicConfig(level=logging.DEBUG if __debug__ else logging.WARN)
-
-try:
-    EXECUTABLE, COMMAND, *ARGV = sys.argv
-    EXEC = os.path.splitext(os.path.basename(EXECUTABLE))[0]
-    if EXEC == 'doctest':
-        DOCTESTDEBUG = logging.debug
-    else:
-        DOCTESTDEBUG = lambda *args, **kwargs: None
-except ValueError:
-    logging.error('sys.argv: %s', sys.argv)
-    if len(sys.argv) == 1 and sys.argv[0] == '':
-        logging.info('module being imported, not a problem')
-    else:
-        raise ValueError('Must specify command and args for that function')
 MATCH_OBJDUMP_DISASSEMBLY = bool(os.getenv('MATCH_OBJDUMP_DISASSEMBLY'))
 
 # labels will cause objdump -D output and mips disassemble output to differ
@@ -29,14 +26,116 @@ MATCH_OBJDUMP_DISASSEMBLY = bool(os.getenv('MATCH_OBJDUMP_DISASSEMBLY'))
 USE_LABELS = AGGRESSIVE_WORDING = not MATCH_OBJDUMP_DISASSEMBLY
 INTCTLVS = os.getenv('MIPS_INTCTLVS', '00100')  # IntCtlVS
 VECTORS = os.getenv('VECTORS', 32)  # 64 on 64 bit machines (?)
-logging.warning('USE_LABELS = %s, AGGRESSIVE_WORDING=%s', USE_LABELS,
-                AGGRESSIVE_WORDING)
+# decode whole images with numpy, if MIPS_NUMPY=1 and it is available;
+# it is imported only then, being slow to import
+USE_NUMPY = (os.getenv('MIPS_NUMPY', '0') != '0' and
+             importlib.util.find_spec('numpy') is not None)
+NUMPY_MINIMUM = 0x100000  # bytes; smaller images don't repay its import
+DECODE_CACHE_SIZE = int(os.getenv('MIPS_DECODE_CACHE', 0x10000))  # words
+# categories of debug logging from the hot paths, given as for example
+# MIPS_TRACE=assemble,args; the others are disassemble and emulate.
+# With python -O it is all compiled out, whatever this says.
+TRACE = frozenset(os.getenv('MIPS_TRACE', '').split(',')) - {''}
+# where serve() listens, and mipsclient.py connects
+SOCKET = os.getenv('MIPS_SOCKET', os.path.join(
+    os.getenv('XDG_RUNTIME_DIR') or '/tmp', 'mips-%d.sock' % os.getuid()))
+SERVICES = ('assemble', 'reassemble', 'disassemble', 'disassemble_word')
+SERVICE_REPLY = struct.Struct('<BL')  # status, 0 if ok, and length of reply
+# directory of the tables derived by init(), saved for the next start;
+# set it empty to derive them every time
+TABLE_CACHE = os.getenv('MIPS_TABLE_CACHE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '__pycache__'))
 
 LABELS = {}  # filled in by init()
 
 STATE = OrderedDict()  # filled in by init()
 
-MEMORY = bytearray()
+# general registers, hi and lo, the 4 coprocessors' registers, and last a
+# word that takes writes to $zero in translated code
+REGFILE = array('I', bytes(4 * (32 + 2 + (4 << 5) + 1)))
+COPROCESSOR_REGISTERS = 32 + 2  # index in REGFILE of the first of these
+SINK = len(REGFILE) - 1
+
+MEMORY = {}  # emulated RAM, 4 KB pages by physical page number
+
+MMIO = {}  # (start, end, read, write) of devices, by physical page number
+
+PAGE_SHIFT = 12  # log2 of the page size
+PAGE_MASK = (1 << PAGE_SHIFT) - 1
+
+# unpack_from of each (size, signed) load, and pack_into of each store
+SIZECODE = ((1, 'B'), (2, 'H'), (4, 'L'), (8, 'Q'))
+LOAD = {(size, signed): struct.Struct(
+            '<' + (code.lower() if signed else code)).unpack_from
+        for size, code in SIZECODE for signed in (True, False)}
+STORE = {size: struct.Struct('<' + code).pack_into for size, code in SIZECODE}
+STORE_MASK = {size: (1 << (size << 3)) - 1 for size in STORE}
+
+# program counter, the address following it, and delay slot state
+CPU = {}  # filled in by emulate()
+
+HANDLERS = {}  # emulation handlers by address, filled in by translate()
+
+OPERANDS = {}  # variable fields of each instruction, filled in by init()
+
+ENCODERS = {}  # fixed bits and operand fields by mnemonic, filled in by init()
+
+EMULATION = {}  # emulation snippets compiled to functions by init()
+
+# code of CONDITIONS, FORMATTER and EMULATION by (table, key), for the
+# table cache, filled in by init()
+COMPILED = {}
+
+# what init() derives from the source tables, and saves in TABLE_CACHE
+DERIVED_TABLES = (
+    'INSTRUCTION', 'REGIMM', 'SPECIAL', 'SPECIAL2', 'COP0', 'COP1', 'COP2',
+    'COP3', 'REGISTER', 'COREGISTER', 'COREGISTERS', 'CONVERSION',
+    'REGISTER_REFERENCE', 'LABELS', 'ENCODERS', 'OPERANDS', 'TRANSFERS',
+    'UNIMPLEMENTED', 'SNIPPETS', 'COMPILED',
+)
+
+TRANSFERS = set()  # names of functions in EMULATION that branch or jump
+
+SNIPPETS = {}  # argument names and source lines of EMULATION functions
+
+UNIMPLEMENTED = set()  # REFERENCE entries whose emulation can't run yet
+
+BLOCKS = {}  # translated basic blocks by address, filled in by run()
+
+CODE_LINES = defaultdict(set)  # addresses of translated code, by line
+
+BLOCK_LIMIT = 256  # most instructions translated into one basic block
+
+CODE_LINE = 8  # log2 of the bytes of physical memory invalidated together
+
+# where emulate() loads the image, and starts running it
+LOAD_ADDRESS = int(os.getenv('MIPS_LOAD_ADDRESS', '0x8c000000'), 16)
+
+# sign bit and mask of each width of number handled by the emulator
+SIGN_BIT = {bits: 1 << (bits - 1) for bits in (8, 16, 32, 64)}
+MASK = {bits: (1 << bits) - 1 for bits in SIGN_BIT}
+
+# what to do with instructions that can't be emulated: `trap` to stop,
+# `skip` to carry on, or `raise` for a NotImplementedError with traceback
+UNKNOWN = os.getenv('MIPS_UNKNOWN', 'trap')
+
+STOPS = set()  # addresses at which emulation stops, filled in by emulate()
+
+# a traced instruction: pc, word, register value, store address and value,
+# REGFILE index of the register, and flags for which of those are valid
+TRACE_RECORD = struct.Struct('<LLLLLHBx')
+TRACE_REGISTER, TRACE_STORE = 1, 2  # flags
+TRACE_BATCH = 0x10000  # records written to a trace file at a time
+
+# start of a snapshot file: magic, pc, the address following it, count of
+# instructions, then the lengths of REGFILE, the page list, and the
+# marshalled DECODED entries, which come next, and the table_key() they
+# were decoded with; last come the pages
+SNAPSHOT_HEADER = struct.Struct('<8sLLQLLL8s')
+SNAPSHOT_MAGIC = b'MIPSSNAP'
+
+# physical address of a transmit register echoing bytes to stdout, if any
+UART = os.getenv('MIPS_UART')
 
 REGISTER = [
     '$' + registername for registername in [
@@ -68,11 +167,15 @@ FLOATREG = [
 # pattern for reading assembly language
 LINEPATTERN = r'^(?:(?P<label>[a-z0-9.]+):)?\s*'  # match label
 LINEPATTERN += r'(?:(?P<mnemonic>[a-z0-9.]+)\s+)?'  # match mnemonic
-LINEPATTERN += r'(?:(?P<args>[a-z0-9$()._,-]+)?\s*)?'  # match args
+LINEPATTERN += r'(?:(?P<args>[a-z0-9$()._,%+-]+)?\s*)?'  # match args
 # assembler leaves a hint at the end of a comment when it turns
 # a machine instruction into a macro/pseudoop. we use these to
 # create identical images to original from unedited disassemblies.
 LINEPATTERN += r"(?:#.*?(?:[(]from '(?P<was>[a-z0-9.]+)'[)])?)?\s*$"
+LINEMATCH = re.compile(LINEPATTERN).match
+# assemble_instruction result for an instruction using a label not seen yet
+PENDING = 'pending label list completion'
+WORD_STRUCT = struct.Struct('<L')
 
 # patterns for assembly language output
 LABEL = '%(label)s'
@@ -152,7 +255,57 @@ PATTERN = {
     'sync': LABEL + MNEMONIC + ARGS['sync'] + COMMENT,
 }
 
+# how render_word gets each name used in PATTERN from a decoded record
+FIELD_EXPRESSION = {
+    'label': "(LABELS[index] + ':') if index in LABELS else ''",
+    'index': 'index',
+    'instruction': 'instruction',
+    'mnemonic': 'mnemonic',
+    'immediate': 'immediate',
+    'longimmediate': 'longimmediate',
+    'comment': 'comment',
+    # to make assembly output match python2
+    'chunkstring': "repr(struct.pack('<L', instruction))[1:]",
+    'rs': 'REGISTER[(instruction >> 21) & 0x1f]',
+    'rt': 'REGISTER[(instruction >> 16) & 0x1f]',
+    'rd': 'REGISTER[(instruction >> 11) & 0x1f]',
+    'target': '(instruction >> 16) & 0x1f',
+    'floatrt': 'FLOATREG[(instruction >> 16) & 0x1f]',
+    'altrt': 'ALTREG[(instruction >> 16) & 0x1f]',
+    'floatrs': 'FLOATREG[(instruction >> 11) & 0x1f]',
+    'floatrd': 'FLOATREG[(instruction >> 6) & 0x1f]',
+    'amount': '(instruction >> 6) & 0x1f',
+    'code': '(instruction >> 6) & 0x3ff',
+    'longcode': '(instruction >> 6) & 0xfffff',
+    'codehigh': '(instruction >> 16) & 0x3ff',  # for breakpoints
+    # longimmediate for jal[x] is shifted by 2
+    # and low bit is set to 1 for jalx but can't find that in documentation
+    'jalximmediate': '((instruction & 0x03ffffff) << 2) | 1',
+    'sel': 'instruction & 0b111',
+    'coregister': 'COREGISTERS[(instruction >> 26) & 0b11]'
+                  '[(instruction >> 11) & 0x1f]',
+    # don't use labels until we've ascertained that output is like objdump
+    'destination': 'LABELS.get(offset, hex(offset)) if USE_LABELS'
+                   ' else hex(offset)',
+}
+
+FORMATTER = {}  # functions to render each PATTERN, filled in by init()
+
+# the tuple returned by decode_word
+RECORD_FIELDS = [
+    'index', 'instruction', 'mnemonic', 'style', 'immediate',
+    'longimmediate', 'offset', 'comment',
+]
+
+COREGISTERS = []  # register names for each coprocessor, filled in by init()
+
+OUTPUT_BATCH = 4096  # lines of disassembly written to stdout at a time
+
 ARGSEP = r'[,()]\s*'
+ARGSPLIT = re.compile(ARGSEP).split
+RELOCATION = re.compile(r'%(?:hi|lo)\([^()]*\)')  # not split by ARGSEP
+# a number or label in a numeric operand
+TERM = re.compile(r'0x[0-9a-f]+|[0-9]+|[a-z_.][a-z0-9_.]*', re.IGNORECASE)
 
 PACKFORMAT = {
     # for Register.bytevalue
@@ -543,7 +696,7 @@ REFERENCE = {
             ['ADD', '100000'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_add(rs, rt, 32, False)'],
+        'emulation': ['rd.value = mips_add(rs.value, rt.value)'],
     },
     'addi': {
         'fields': [
@@ -553,8 +706,9 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['arg = c_int16(immediate).value',
-                      'rt.value = mips_add(rs, arg, 32, False)']
+        'emulation': [
+            'rt.value = mips_add(rs.value, mips_signed(immediate, 16))',
+        ],
     },
     'addiu': {
         'fields': [
@@ -564,8 +718,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['arg = c_int16(immediate).value',  # sign-extend it
-                      'rt.value = mips_add(rs, rt, 32, True)'],
+        'emulation': [
+            'rt.value = mips_add(rs.value, mips_signed(immediate, 16),'
+            ' 32, True)',
+        ],
     },
     'addu': {
         'fields': [
@@ -577,7 +733,7 @@ REFERENCE = {
             ['ADDU', '100001'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_add(rs, rt, 32, True)'],
+        'emulation': ['rd.value = mips_add(rs.value, rt.value, 32, True)'],
     },
     'and': {
         'fields': [
@@ -589,7 +745,7 @@ REFERENCE = {
             ['AND', '100100'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = rs & rt'],
+        'emulation': ['rd.value = rs.value & rt.value'],
     },
     'andi': {
         'fields': [
@@ -599,7 +755,7 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['rt.value = rs & immediate'],
+        'emulation': ['rt.value = rs.value & immediate'],
     },
     'b': {
         'alias_of': [['beq', '$zero,$zero,offset']],
@@ -617,8 +773,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,rt,offset'],
-        'emulation': ['if rs == rt: address = (offset << 2) + pc; '
-                     'do_next(); jump(address)'],
+        'emulation': ['mips_branch(pc, offset, rs.value == rt.value)'],
     },
     'beql': {
         'fields': [
@@ -628,7 +783,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,rt,offset'],
-        'emulation': ['if rs == rt: mips_branch(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, rs.value == rt.value, likely=True)',
+        ],
     },
     'beqz': {
         'alias_of': [['beq', 'rs,$zero,offset']],
@@ -646,7 +803,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs >= 0: mips_jump(offset)'],
+        'emulation': ['mips_branch(pc, offset, mips_signed(rs.value) >= 0)'],
     },
     'bgezal': {
         'fields': [
@@ -656,7 +813,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs >= 0: mips_jump(offset)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) >= 0)',
+            "STATE['$ra'].value = pc + 8",
+        ],
     },
     'bgezall': {
         'fields': [
@@ -666,7 +826,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs >= 0: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) >= 0, likely=True)',
+            "STATE['$ra'].value = pc + 8",
+        ],
     },
     'bgezl': {
         'fields': [
@@ -676,7 +839,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs >= 0: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) >= 0, likely=True)',
+        ],
     },
     'bgtz': {
         'fields': [
@@ -686,8 +851,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if mips_signed(rs.value, rs.size) > 0: '
-                     'do_next(); mips_jump(offset)'],
+        'emulation': ['mips_branch(pc, offset, mips_signed(rs.value) > 0)'],
     },
     'bgtzl': {
         'fields': [
@@ -697,7 +861,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs > 0: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) > 0, likely=True)',
+        ],
     },
     'blez': {
         'fields': [
@@ -707,8 +873,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if mips_signed(rs.value, rs.size) < 0: '
-                     'do_next(); mips_jump(offset)'],
+        'emulation': ['mips_branch(pc, offset, mips_signed(rs.value) <= 0)'],
     },
     'blezl': {
         'fields': [
@@ -718,7 +883,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs < 0: mips_jump(offset)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) <= 0, likely=True)',
+        ],
     },
     'bltz': {
         'fields': [
@@ -728,8 +895,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if mips_signed(rs.value, rs.size) < 0: '
-                     'do_next(); mips_jump(offset)'],
+        'emulation': ['mips_branch(pc, offset, mips_signed(rs.value) < 0)'],
     },
     'bltzal': {
         'fields': [
@@ -739,7 +905,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs < 0: mips_jump(offset)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) < 0)',
+            "STATE['$ra'].value = pc + 8",
+        ],
     },
     'bltzall': {
         'fields': [
@@ -749,7 +918,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs < 0: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) < 0, likely=True)',
+            "STATE['$ra'].value = pc + 8",
+        ],
     },
     'bltzl': {
         'fields': [
@@ -759,7 +931,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,offset'],
-        'emulation': ['if rs < 0: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, mips_signed(rs.value) < 0, likely=True)',
+        ],
     },
     'bne': {
         'fields': [
@@ -769,8 +943,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,rt,offset'],
-        'emulation': ['if rs.value != rt.value: address = (offset << 2) + pc; '
-                     'do_next(); mips_jump(address)'],
+        'emulation': ['mips_branch(pc, offset, rs.value != rt.value)'],
     },
     'bnel': {
         'fields': [
@@ -780,7 +953,9 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,rt,offset'],
-        'emulation': ['if rs != rt: mips_jump(offset, likely=True)'],
+        'emulation': [
+            'mips_branch(pc, offset, rs.value != rt.value, likely=True)',
+        ],
     },
     'bnez': {
         'alias_of': [['bne', 'rs,$zero,offset']],
@@ -798,7 +973,7 @@ REFERENCE = {
             ['BREAK', '001101'],
         ],
         'args': ['codehi,codelo', [None, '0,0']],
-        'emulation': ['mips_break()'],
+        'emulation': ['mips_break(codehi, codelo)'],
     },
     'c0': {
         'fields': [
@@ -868,7 +1043,7 @@ REFERENCE = {
             ['DADD', '101100'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_add(rs, rt, 64, False)'],
+        'emulation': ['rd.value = mips_add(rs.value, rt.value, 64)'],
     },
     'daddi': {
         'fields': [
@@ -878,8 +1053,9 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['arg = c_int16(immediate).value',  # sign-extend it
-                      'rt.value = mips_add(rs, arg, 64, False)'],
+        'emulation': [
+            'rt.value = mips_add(rs.value, mips_signed(immediate, 16), 64)',
+        ],
     },
     'daddiu': {
         'fields': [
@@ -889,8 +1065,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['arg = c_int16(immediate).value',  # sign-extend it
-                      'rt.value = mips_add(rs, arg, 64, True)'],
+        'emulation': [
+            'rt.value = mips_add(rs.value, mips_signed(immediate, 16),'
+            ' 64, True)',
+        ],
     },
     'daddu': {
         'fields': [
@@ -902,7 +1080,7 @@ REFERENCE = {
             ['DADDU', '101101'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_add(rs, rt, 64, True)'],
+        'emulation': ['rd.value = mips_add(rs.value, rt.value, 64, True)'],
     },
     'ddiv': {
         # obdjump incorrectly dumps ddiv as arithlog
@@ -916,7 +1094,7 @@ REFERENCE = {
             ['DDIV', '011110'],
         ],
         'args': ['rd,rs,rt', ['rs,rt', '$zero,rs,rt']],
-        'emulation': ['lo.value, hi.value = mips_div(rs, rt, 64, False)'],
+        'emulation': ['lo.value, hi.value = mips_div(rs.value, rt.value, 64)'],
     },
     'ddivu': {
         # obdjump incorrectly dumps ddivu as arithlog
@@ -930,7 +1108,9 @@ REFERENCE = {
             ['DDIVU', '011111'],
         ],
         'args': ['rd,rs,rt', ['rs,rt', '$zero,rs,rt']],
-        'emulation': ['lo.value, hi.value = mips_div(rs, rt, 64, True)'],
+        'emulation': [
+            'lo.value, hi.value = mips_div(rs.value, rt.value, 64, True)',
+        ],
     },
     'deret': {
         'fields': [
@@ -954,7 +1134,7 @@ REFERENCE = {
             ['DIV', '011010'],
         ],
         'args': ['rd,rs,rt', ['rs,rt', '$zero,rs,rt']],
-        'emulation': ['lo.value, hi.value = mips_div(rs, rt, 32, False)'],
+        'emulation': ['lo.value, hi.value = mips_div(rs.value, rt.value)'],
     },
     'divu': {
         # obdjump incorrectly dumps ddiv as arithlog
@@ -968,7 +1148,9 @@ REFERENCE = {
             ['DIVU', '011011'],
         ],
         'args': ['rd,rs,rt', ['rs,rt', '$zero,rs,rt']],
-        'emulation': ['lo.value, hi.value = mips_div(rs, rt, 32, True)'],
+        'emulation': [
+            'lo.value, hi.value = mips_div(rs.value, rt.value, 32, True)',
+        ],
     },
     'dmult': {
         'fields': [
@@ -979,7 +1161,9 @@ REFERENCE = {
             ['DMULT', '011100'],
         ],
         'args': ['rs, rt'],
-        'emulation': ['mips_mult(rs, rt, 64, False)'],
+        'emulation': [
+            'hi.value, lo.value = mips_multiply(rs.value, rt.value, 64)',
+        ],
     },
     'dmultu': {
         'fields': [
@@ -990,7 +1174,9 @@ REFERENCE = {
             ['DMULTU', '011101'],
         ],
         'args': ['rs, rt'],
-        'emulation': ['mips_mult(rs, rt, 64, True)'],
+        'emulation': [
+            'hi.value, lo.value = mips_multiply(rs.value, rt.value, 64, True)',
+        ],
     },
     'dneg': {
         'alias_of': [['dsub', 'rd,$zero,rt']],
@@ -1010,7 +1196,7 @@ REFERENCE = {
             ['DSLL', '111000'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = rt << sa'],
+        'emulation': ['rd.value = rt.value << sa'],
     },
     'dsll32': {
         'fields': [
@@ -1022,7 +1208,7 @@ REFERENCE = {
             ['DSLL32', '111100'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = rt << (sa + 32)'],
+        'emulation': ['rd.value = rt.value << (sa + 32)'],
     },
     'dsllv': {
         'fields': [
@@ -1034,7 +1220,7 @@ REFERENCE = {
             ['DSLLV', '010100'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.value = rt << rs & 0b11111'],
+        'emulation': ['rd.value = rt.value << (rs.value & 0b111111)'],
     },
     'dsra': {
         'fields': [
@@ -1046,7 +1232,7 @@ REFERENCE = {
             ['DSRA', '111011'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = rt >> sa'],
+        'emulation': ['rd.value = mips_signed(rt.value) >> sa'],
     },
     'dsra32': {
         'fields': [
@@ -1058,7 +1244,7 @@ REFERENCE = {
             ['DSRA32', '111111'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = rt >> (sa + 32)'],
+        'emulation': ['rd.value = mips_signed(rt.value) >> (sa + 32)'],
     },
     'dsrav': {
         'fields': [
@@ -1070,7 +1256,9 @@ REFERENCE = {
             ['DSRAV', '010111'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.value = rt >> rs'],
+        'emulation': [
+            'rd.value = mips_signed(rt.value) >> (rs.value & 0b111111)',
+        ],
     },
     'dsrl': {
         'fields': [
@@ -1082,7 +1270,9 @@ REFERENCE = {
             ['DSRL', '111010'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.uvalue = rt.uvalue >> sa'],
+        'emulation': [
+            'rd.value = (mips_signed(rt.value) & 0xffffffffffffffff) >> sa',
+        ],
     },
     'dsrl32': {
         'fields': [
@@ -1094,7 +1284,10 @@ REFERENCE = {
             ['DSRL', '111110'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.uvalue = rt.uvalue >> (sa + 32)'],
+        'emulation': [
+            'rd.value = (mips_signed(rt.value) & 0xffffffffffffffff)'
+            ' >> (sa + 32)',
+        ],
     },
     'dsrlv': {
         'fields': [
@@ -1106,7 +1299,10 @@ REFERENCE = {
             ['DSRLV', '010110'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.uvalue = rt.uvalue >> (rs & 0b11111)'],
+        'emulation': [
+            'rd.value = (mips_signed(rt.value) & 0xffffffffffffffff)'
+            ' >> (rs.value & 0b111111)',
+        ],
     },
     'dsub': {
         'fields': [
@@ -1118,7 +1314,7 @@ REFERENCE = {
             ['DSUB', '101110'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_sub(rs, rt, 64, False)'],
+        'emulation': ['rd.value = mips_subtract(rs.value, rt.value, 64)'],
     },
     'dsubu': {
         'fields': [
@@ -1130,7 +1326,9 @@ REFERENCE = {
             ['DSUB', '101111'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_sub(rs, rt, 64, True)'],
+        'emulation': [
+            'rd.value = mips_subtract(rs.value, rt.value, 64, True)',
+        ],
     },
     'ehb': {
         'alias_of': [['sll', '$zero,$zero,3']],
@@ -1152,7 +1350,7 @@ REFERENCE = {
             ['target', 'bbbbbbbbbbbbbbbbbbbbbbbbbb'],
         ],
         'args': ['target'],
-        'emulation': ['mips_jump(target)'],
+        'emulation': ['mips_jump(((pc + 4) & 0xf0000000) | (target << 2))'],
     },
     'jal': {
         'fields': [
@@ -1160,7 +1358,10 @@ REFERENCE = {
             ['target', 'bbbbbbbbbbbbbbbbbbbbbbbbbb'],
         ],
         'args': ['target'],
-        'emulation': ['mips_jump(target)'],
+        'emulation': [
+            'mips_jump(((pc + 4) & 0xf0000000) | (target << 2))',
+            "STATE['$ra'].value = pc + 8",
+        ],
     },
     'jalr': {
         'fields': [
@@ -1172,7 +1373,7 @@ REFERENCE = {
             ['JALR', '001001'],
         ],
         'args': ['rd,rs', ['rs', '$ra,rs']],
-        'emulation': ['rd.value = pc + 4; do_next(); jump(rs.value)'],
+        'emulation': ['mips_jump(rs.value)', 'rd.value = pc + 8'],
     },
     'jalx': {
         'fields': [
@@ -1191,7 +1392,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.value = c_byte(MEMORY[base + offset]).value'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 1)'],
     },
     'ld': {
         'fields': [
@@ -1201,7 +1402,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.value = mips_load(base, offset, "d")'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 8)'],
     },
     'ldc1': {
         'fields': [
@@ -1211,7 +1412,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_load(1, rt, base, offset)'],
+        'emulation': ['mips_coprocessor_load(1, rt, base.value, offset, 8)'],
     },
     'ldc2': {
         'fields': [
@@ -1221,7 +1422,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_load(2, rt, base, offset)'],
+        'emulation': ['mips_coprocessor_load(2, rt, base.value, offset, 8)'],
     },
     'lh': {
         'fields': [
@@ -1231,7 +1432,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_load(rt, base, offset, "h")'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 2)'],
     },
     'll': {
         'fields': [
@@ -1241,7 +1442,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.value = mips_load(base, offset)'],
+        'emulation': ['rt.value = mips_load(base.value, offset)'],
     },
     'lld': {
         'fields': [
@@ -1251,7 +1452,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.value = mips_load(base, offset, bits=64)'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 8)'],
     },
     'jr': {
         'fields': [
@@ -1271,7 +1472,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.value = mips_load(base, offset, "b", signed=False)'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 1, False)'],
     },
     'ldl': {
         'fields': [
@@ -1281,7 +1482,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_ldl(rt, base, offset)'],
+        'emulation': ['mips_reserved("ldl")'],
     },
     'ldr': {
         'fields': [
@@ -1291,7 +1492,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_ldr(rt, base, offset)'],
+        'emulation': ['mips_reserved("ldr")'],
     },
     'lhu': {
         'fields': [
@@ -1301,7 +1502,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.uvalue = mips_load(offset, base, "h")'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 2, False)'],
     },
     'li': {
         'alias_of': [['addiu', 'rt,$zero,offset'], ['ori', 'rt,$zero,offset']],
@@ -1315,7 +1516,7 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,immediate'],
-        'emulation': ['rt.value = c_int16(immediate).value'],
+        'emulation': ['rt.value = immediate << 16'],
     },
     'lw': {
         'fields': [
@@ -1325,7 +1526,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_lw(rt, offset, base)'],
+        'emulation': ['rt.value = mips_load(base.value, offset)'],
     },
     'lwc1': {
         'fields': [
@@ -1335,7 +1536,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_load(1, rt, offset, base, "w")'],
+        'emulation': ['mips_coprocessor_load(1, rt, base.value, offset)'],
     },
     'lwc2': {
         'fields': [
@@ -1345,7 +1546,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_load(2, rt, offset, base, "w")'],
+        'emulation': ['mips_coprocessor_load(2, rt, base.value, offset)'],
     },
     'lwc3': {
         'fields': [
@@ -1355,7 +1556,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_load(3, rt, offset, base, "w")'],
+        'emulation': ['mips_coprocessor_load(3, rt, base.value, offset)'],
     },
     'lwl': {
         'fields': [
@@ -1365,7 +1566,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_lw(rt, offset, base, "left")'],
+        'emulation': ['rt.value = mips_lwl(rt.value, base.value, offset)'],
     },
     'lwr': {
         'fields': [
@@ -1375,7 +1576,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_lw(rt, offset, base, "right")'],
+        'emulation': ['rt.value = mips_lwr(rt.value, base.value, offset)'],
     },
     'lwu': {
         'fields': [
@@ -1385,7 +1586,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['rt.uvalue = mips_load(offset, base)'],
+        'emulation': ['rt.value = mips_load(base.value, offset, 4, False)'],
     },
     'mfc0': {
         'fields': [
@@ -1440,7 +1641,7 @@ REFERENCE = {
             ['MOVN', '001011'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['if rt != 0: rd.value = rs'],
+        'emulation': ['if rt.value != 0: rd.value = rs.value'],
     },
     'movz': {
         'fields': [
@@ -1452,7 +1653,7 @@ REFERENCE = {
             ['MOVZ', '001010'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['if rt == 0: rd.value = rs'],
+        'emulation': ['if rt.value == 0: rd.value = rs.value'],
     },
     'mtc0': {
         'fields': [
@@ -1474,7 +1675,7 @@ REFERENCE = {
             ['MTHI', '010001'],
         ],
         'args': ['rs'],
-        'emulation': ['mips_mthi(rs.value)'],
+        'emulation': ['hi.value = rs.value'],
     },
     'mtlo': {
         'fields': [
@@ -1484,7 +1685,7 @@ REFERENCE = {
             ['MTLO', '010011'],
         ],
         'args': ['rs'],
-        'emulation': ['mips_mtlo(rs.value)'],
+        'emulation': ['lo.value = rs.value'],
     },
     'mul': {
         'fields': [
@@ -1496,7 +1697,9 @@ REFERENCE = {
             ['MUL', '000010'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_mult(rs, rt, 32, False, True)'],
+        'emulation': [
+            'rd.value = mips_multiply(rs.value, rt.value, 32, False, True)',
+        ],
     },
     'mult': {
         'fields': [
@@ -1507,7 +1710,9 @@ REFERENCE = {
             ['MULT', '011000'],
         ],
         'args': ['rs, rt'],
-        'emulation': ['mips_mult(rs, rt, 32, False)'],
+        'emulation': [
+            'hi.value, lo.value = mips_multiply(rs.value, rt.value)',
+        ],
     },
     'multu': {
         'fields': [
@@ -1518,7 +1723,9 @@ REFERENCE = {
             ['MULTU', '011001'],
         ],
         'args': ['rs, rt'],
-        'emulation': ['mips_mult(rs, rt, 32, True)'],
+        'emulation': [
+            'hi.value, lo.value = mips_multiply(rs.value, rt.value, 32, True)',
+        ],
     },
     'neg': {
         'alias_of': [['sub', 'rd,$zero,rt']],
@@ -1564,7 +1771,7 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['rt.value = rs | immediate'],
+        'emulation': ['rt.value = rs.value | immediate'],
     },
     'sb': {
         'fields': [
@@ -1574,7 +1781,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(offset, base, value, "b")'],
+        'emulation': ['mips_store(rt.value, base.value, offset, 1)'],
     },
     'sc': {
         'fields': [
@@ -1584,7 +1791,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(rt, base, offset, atomic=True)'],
+        'emulation': [
+            'mips_store(rt.value, base.value, offset)',
+            'rt.value = 1',
+        ],
     },
     'scd': {
         'fields': [
@@ -1594,7 +1804,10 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(rt, base, offset, "d", atomic=True)'],
+        'emulation': [
+            'mips_store(rt.value, base.value, offset, 8)',
+            'rt.value = 1',
+        ],
     },
     'sd': {
         'fields': [
@@ -1604,7 +1817,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(offset + contents(base), contents(rt))'],
+        'emulation': ['mips_store(rt.value, base.value, offset, 8)'],
     },
     'sdc1': {
         'fields': [
@@ -1614,7 +1827,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_store(1, rt, offset, base, rt, "d")'],
+        'emulation': ['mips_coprocessor_store(1, rt, base.value, offset, 8)'],
     },
     'sdc2': {
         'fields': [
@@ -1624,7 +1837,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_store(2, rt, offset, base, rt, "d")'],
+        'emulation': ['mips_coprocessor_store(2, rt, base.value, offset, 8)'],
     },
     'sdl': {
         'fields': [
@@ -1634,7 +1847,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(offset, base, rt, "d", "left")'],
+        'emulation': ['mips_reserved("sdl")'],
     },
     'sdr': {
         'fields': [
@@ -1644,7 +1857,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(offset, base, rt, "d", "right")'],
+        'emulation': ['mips_reserved("sdr")'],
     },
     'sh': {
         'fields': [
@@ -1654,7 +1867,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(rt, offset, base, "h")'],
+        'emulation': ['mips_store(rt.value, base.value, offset, 2)'],
     },
     'sll': {
         'fields': [
@@ -1678,7 +1891,7 @@ REFERENCE = {
             ['SLLV', '000100'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.value = rt.value << rs.value & 0b11111'],
+        'emulation': ['rd.value = rt.value << (rs.value & 0b11111)'],
     },
     'slt': {
         'fields': [
@@ -1690,7 +1903,9 @@ REFERENCE = {
             ['SLT', '101010'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = c_int32(rs).value < c_int32(rt).value'],
+        'emulation': [
+            'rd.value = mips_signed(rs.value) < mips_signed(rt.value)',
+        ],
     },
     'slti': {
         'fields': [
@@ -1700,8 +1915,9 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['rt.value = mips_signed(rs.value, rs.size) < '
-                     'mips_signed(immediate, 16)'],
+        'emulation': [
+            'rt.value = mips_signed(rs.value) < mips_signed(immediate, 16)',
+        ],
     },
     'sltiu': {
         'fields': [
@@ -1711,7 +1927,9 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['rt.value = rs.value < immediate'],
+        'emulation': [
+            'rt.value = rs.value < mips_signed(immediate, 16) & 0xffffffff',
+        ],
     },
     'sltu': {
         'fields': [
@@ -1723,7 +1941,7 @@ REFERENCE = {
             ['SLTU', '101011'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = rs < rt'],
+        'emulation': ['rd.value = rs.value < rt.value'],
     },
     'sra': {
         'fields': [
@@ -1735,7 +1953,7 @@ REFERENCE = {
             ['SRA', '000011'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = mips_sra(rt.value, sa)'],
+        'emulation': ['rd.value = mips_signed(rt.value) >> sa'],
     },
     'srav': {
         'fields': [
@@ -1747,7 +1965,9 @@ REFERENCE = {
             ['SRAV', '000111'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.value = rt >> rs'],
+        'emulation': [
+            'rd.value = mips_signed(rt.value) >> (rs.value & 0b11111)',
+        ],
     },
     'srl': {
         'fields': [
@@ -1759,7 +1979,7 @@ REFERENCE = {
             ['SRL', '000010'],
         ],
         'args': ['rd,rt,sa'],
-        'emulation': ['rd.value = mips_srl(rt.value, sa)'],
+        'emulation': ['rd.value = rt.value >> sa'],
     },
     'srlv': {
         'fields': [
@@ -1771,7 +1991,7 @@ REFERENCE = {
             ['SRLV', '000110'],
         ],
         'args': ['rd,rt,rs'],
-        'emulation': ['rd.value = mips_srl(rt, rs)'],
+        'emulation': ['rd.value = rt.value >> (rs.value & 0b11111)'],
     },
     'ssnop': {
         'alias_of': [['sll', '$zero,$zero,1']],
@@ -1787,7 +2007,7 @@ REFERENCE = {
             ['SUB', '100010'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_subtract(rs, rt, 32, False)'],
+        'emulation': ['rd.value = mips_subtract(rs.value, rt.value)'],
     },
     'subu': {
         'fields': [
@@ -1799,7 +2019,9 @@ REFERENCE = {
             ['SUBU', '100011'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = mips_subtract(rs, rt, 32, True)'],
+        'emulation': [
+            'rd.value = mips_subtract(rs.value, rt.value, 32, True)',
+        ],
     },
     'sw': {
         'fields': [
@@ -1809,14 +2031,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': [
-            'shadow = c_int32(base)',
-            'shadow.value += offset',
-            'value = struct.pack("<L", rt.value)',
-            'logging.debug("memory before SW: %s", MEMORY[shadow.value:][:4])',
-            'MEMORY[shadow.value:shadow.value + 4] = list(value)',
-            'logging.debug("memory after SW: %s", MEMORY[shadow.value:][:4])',
-        ],
+        'emulation': ['mips_store(rt.value, base.value, offset)'],
     },
     'swc1': {
         'fields': [
@@ -1826,7 +2041,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_store(1, offset, base, rt)'],
+        'emulation': ['mips_coprocessor_store(1, rt, base.value, offset)'],
     },
     'swc2': {
         'fields': [
@@ -1836,7 +2051,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_store(2, offset, base, rt)'],
+        'emulation': ['mips_coprocessor_store(2, rt, base.value, offset)'],
     },
     'swc3': {
         'fields': [
@@ -1846,7 +2061,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_coprocessor_store(3, offset, base, rt)'],
+        'emulation': ['mips_coprocessor_store(3, rt, base.value, offset)'],
     },
     'swl': {
         'fields': [
@@ -1856,7 +2071,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(rt, offset, base, "w", "left")'],
+        'emulation': ['mips_swl(rt.value, base.value, offset)'],
     },
     'swr': {
         'fields': [
@@ -1866,7 +2081,7 @@ REFERENCE = {
             ['offset', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,offset(base)'],
-        'emulation': ['mips_store(rt, offset, base, "w", "right")'],
+        'emulation': ['mips_swr(rt.value, base.value, offset)'],
     },
     'sync': {
         'fields': [
@@ -1885,7 +2100,7 @@ REFERENCE = {
             ['SYSCALL', '001100'],
         ],
         'args': ['code', [None, '0']],
-        'emulation': ['mips_syscall()'],
+        'emulation': ['mips_syscall(code)'],
     },
     'teq': {
         'fields': [
@@ -1906,7 +2121,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,immediate'],
-        'emulation': ['if rs == immediate: mips_trap(code)'],
+        'emulation': [
+            'if rs.value == mips_signed(immediate, 16) & 0xffffffff:'
+            ' mips_trap()',
+        ],
     },
     'tge': {
         'fields': [
@@ -1917,7 +2135,10 @@ REFERENCE = {
             ['TGE', '110000'],
         ],
         'args': ['rs,rt,code', ['rs,rt', 'rs,rt,0']],
-        'emulation': ['if mips_signed(rs) > mips_signed(rt): mips_trap(code)'],
+        'emulation': [
+            'if mips_signed(rs.value) >= mips_signed(rt.value):'
+            ' mips_trap(code)',
+        ],
     },
     'tgei': {
         'fields': [
@@ -1927,7 +2148,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,immediate'],
-        'emulation': ['if rs.value >= c_int16(immediate).value: mips_trap()'],
+        'emulation': [
+            'if mips_signed(rs.value) >= mips_signed(immediate, 16):'
+            ' mips_trap()',
+        ],
     },
     'tgeiu': {
         'fields': [
@@ -1937,8 +2161,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,immediate'],
-        'emulation': ['if rs.uvalue >= c_int16(immediate).value & 0xffffffff): '
-                     'mips_trap(0)'],
+        'emulation': [
+            'if rs.value >= mips_signed(immediate, 16) & 0xffffffff:'
+            ' mips_trap()',
+        ],
     },
     'tgeu': {
         'fields': [
@@ -1949,7 +2175,7 @@ REFERENCE = {
             ['TGEU', '110001'],
         ],
         'args': ['rs,rt,code', ['rs,rt', 'rs,rt,0']],
-        'emulation': ['if rs > rt: mips_trap(code)'],
+        'emulation': ['if rs.value >= rt.value: mips_trap(code)'],
     },
     'tlbwi': {
         'fields': [
@@ -1980,8 +2206,10 @@ REFERENCE = {
             ['TLT', '110010'],
         ],
         'args': ['rs,rt,code', ['rs,rt', 'rs,rt,0']],
-        'emulation': ['if mips_signed(rs.value, rs.size) < '
-                     'mips_signed(rt.value, rt.size): mips_trap()'],
+        'emulation': [
+            'if mips_signed(rs.value) < mips_signed(rt.value):'
+            ' mips_trap(code)',
+        ],
     },
     'tlti': {
         'fields': [
@@ -1991,7 +2219,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,immediate'],
-        'emulation': ['if rs < c_int16(immediate).value: mips_trap()'],
+        'emulation': [
+            'if mips_signed(rs.value) < mips_signed(immediate, 16):'
+            ' mips_trap()',
+        ],
     },
     'tltiu': {
         'fields': [
@@ -2001,8 +2232,10 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rs,immediate'],
-        'emulation': ['if rs.uvalue < c_int16(immediate).value & 0xffffffff):'
-        ' mips_trap()'],
+        'emulation': [
+            'if rs.value < mips_signed(immediate, 16) & 0xffffffff:'
+            ' mips_trap()',
+        ],
     },
     'tltu': {
         'fields': [
@@ -2013,7 +2246,7 @@ REFERENCE = {
             ['TLTU', '110011'],
         ],
         'args': ['rs,rt,code', ['rs,rt', 'rs,rt,0']],
-        'emulation': ['if rs.value < rt.value: mips_trap()'],
+        'emulation': ['if rs.value < rt.value: mips_trap(code)'],
     },
     'tne': {
         'fields': [
@@ -2046,7 +2279,7 @@ REFERENCE = {
             ['XOR', '100110'],
         ],
         'args': ['rd,rs,rt'],
-        'emulation': ['rd.value = rs ^ rt'],
+        'emulation': ['rd.value = rs.value ^ rt.value'],
     },
     'xori': {
         'fields': [
@@ -2056,12 +2289,21 @@ REFERENCE = {
             ['immediate', 'bbbbbbbbbbbbbbbb'],
         ],
         'args': ['rt,rs,immediate'],
-        'emulation': ['rt.value = rs ^ immediate'],
+        'emulation': ['rt.value = rs.value ^ immediate'],
     },
 }
 
 REGISTER_REFERENCE = {}  # filled in by init()
 
+# instruction fields available to the 'condition' expressions in the
+# disassembly tables and CONVERSION, in the order passed by disassemble_chunk
+CONDITION_ARGS = [
+    'instruction', 'source', 'target', 'dest', 'amount', 'code', 'longcode',
+    'function', 'longimmediate', 'sel', 'mtzero',
+]
+
+CONDITIONS = {}  # condition strings compiled to functions by init()
+
 CONVERSION = {
     # NOTE: put the most restrictive conditions FIRST, because the conversion
     # process is not a loop; for example, 'b' should come before 'beqz'
@@ -2127,45 +2369,47 @@ class Register(object):
     r'''
     Represent a MIPS general register for emulation
 
-    >>> logging.debug('All registers should have been created by now!')
+    Only a view: the contents are kept in REGFILE, at `index`.
+
     >>> Register('$zero').value = 2
     >>> register = Register('$at')
-    >>> logging.debug('setting $at to 0xffffffff')
     >>> register.value = 0xffffffff
-    >>> logging.warning('setting $at register bytevalue')
     >>> register.bytevalue = (b'\x55\x44\x33', 1)
-    >>> '0x%08x' % register.value
-    '0x334455ff'
+    >>> '0x%08x' % register.value, REGFILE[register.index] == register.value
+    ('0x334455ff', True)
     '''
+    __slots__ = ('name', 'number', 'index')
     registers = {}
-    def __new__(cls, *args, **kwargs):
-        name = args[0]
+
+    def __new__(cls, name, *args, **kwargs):
         if name[1:].isdigit():
             number = int(name[1:])
-            if number in cls.registers:
-                register = cls.registers[number]
-                logging.debug('returning existing register %s', register)
-            else:
+            if number not in cls.registers:
                 raise ValueError('Cannot create register with numeric name')
+            return cls.registers[number]
         elif name in cls.registers:
-            register = cls.registers[name]
-            logging.debug('returning already existing register %s', register)
-            return register
+            return cls.registers[name]
         else:
-            logging.debug('creating new Register(%s)', name)
             return super().__new__(cls)
 
-    def __init__(self, name, number=None, value=0): 
-        logging.debug('initializing register %s', name)
+    def __init__(self, name, number=None, value=0):
         if not name in self.registers:
             self.name = name
             if number is None:
                 number = REGISTER_REFERENCE[name]
-            self.number = number
+            self.number = self.index = number
             self.registers[name] = self
             self.registers[number] = self
             self.value = value
 
+    @property
+    def value(self):
+        return REGFILE[self.index]
+
+    @value.setter
+    def value(self, value):
+        REGFILE[self.index] = value & 0xffffffff
+
     def __index__(self):
         return self.value
 
@@ -2183,34 +2427,26 @@ class Register(object):
         '''
         Return 32-bit register contents as bytes
         '''
-        array = struct.pack(PACKFORMAT[32], self.value)
-        DOCTESTDEBUG('Register.bytevalue returning bytes %s', array)
-        return array
+        return struct.pack(PACKFORMAT[32], self.value)
 
     @bytevalue.setter
     def bytevalue(self, args):
         '''
         Store bytes in 32-bit register
         '''
-        DOCTESTDEBUG('Register.bytevalue setter args: %s', args)
         databytes, start = args
         array = bytearray(self.bytevalue)
-        DOCTESTDEBUG('setting bytevalue at offset %d to %r', start, databytes)
         array[start:start + len(databytes)] = databytes
-        value = struct.unpack(PACKFORMAT[32], array)[0]
-        DOCTESTDEBUG('Storing updated value 0x%08x in register %s', value, self)
-        self.value = value
+        self.value = struct.unpack(PACKFORMAT[32], array)[0]
 
 class ZeroRegister(Register):
     '''
     Special case for $zero
     '''
-    def _warn(self, value):
-        if value != 0:
-            logging.info('Attempt to set zero register to %r', value)
+    __slots__ = ()
 
-    # This subclass has a fixed value
-    value = property(lambda *args: 0, _warn)
+    # This subclass has a fixed value, and writes to it are ignored
+    value = property(lambda *args: 0, lambda *args: None)
 
     def __repr__(self):
         return '<$zr(0)=0>'
@@ -2220,40 +2456,50 @@ class CoprocessorRegister(object):
     Separate from general registers.
 
     Each coprocessor 0 register number has up to 4 actual registers,
-    determined by a 3-bit selector.
+    determined by a 3-bit selector. Only a view, like Register.
+
+    >>> register = CoprocessorRegister(0, 'c0_sr')
+    >>> register is CoprocessorRegister.registers[0][12], register.index
+    (True, 46)
     '''
+    __slots__ = ('name', 'number', 'index')
     registers = {0: {}, 1: {}, 2: {}, 3: {}}
 
-    def __new__(cls, coprocessor, name, number=0, selector=None):
-        if name[1:].isdigit():  # register in $28 form
-            number = int(name[1:])
-            if number in cls.registers[coprocessor]:
-                register = cls.registers[coprocessor][number]
-                logging.debug('returning existing register %s', register)
-        elif name in cls.registers:
-            register = cls.registers[coprocessor][name]
-            logging.debug('returning already existing register %s', register)
-            return register
+    def __new__(cls, coprocessor, name, number=None, selector=None):
+        registers = cls.registers[coprocessor]
+        if name[1:].isdigit() and int(name[1:]) in registers:
+            return registers[int(name[1:])]  # register in $28 form
+        elif name in registers:
+            return registers[name]
         else:
-            logging.debug('creating new CoprocessorRegister(%s)', name)
             return super().__new__(cls)
 
-    def __init__(self, coprocessor, name, number=None, selector=None): 
-        logging.debug('initializing coprocessor register %s', name)
-        if not name in self.registers[coprocessor]:
+    def __init__(self, coprocessor, name, number=None, selector=None):
+        registers = self.registers[coprocessor]
+        if not name in registers:
             self.name = name
             if number is None:
                 if coprocessor == 0:
-                    number = COREGISTER.index(name)
+                    number = [key for key, value in COREGISTER.items()
+                              if value == name][0]
                 elif name[1:].isdigit():  # '$11' form
                     number = int(name[1:])
                 else:
                     number = int(name[2:])  # '$f12' form
             self.number = number
-            self.registers[name] = self
-            self.registers[number] = self
+            self.index = COPROCESSOR_REGISTERS + (coprocessor << 5) + number
+            registers[name] = self
+            registers[number] = self
             self.value = 0
 
+    @property
+    def value(self):
+        return REGFILE[self.index]
+
+    @value.setter
+    def value(self, value):
+        REGFILE[self.index] = value & 0xffffffff
+
     def __index__(self):
         return self.value
 
@@ -2265,154 +2511,590 @@ class CoprocessorRegister(object):
 
     def __repr__(self):
         return '<%s(%d)=%d>' % (self.name, self.number, self.value)
-        pass
 
-def disassemble(filespec):
+class DecodeCache(object):
+    '''
+    Bounded LRU cache of decode_fields results, keyed by instruction word
+
+    Firmware repeats the same words over and over, so most of them need
+    decoding only once. The counters help in choosing a size.
+
+    >>> cache = DecodeCache(2)
+    >>> for word in 0, 1, 0, 2, 1:
+    ...     if cache.get(word) is None:
+    ...         decoded = cache.put(word, str(word))
+    >>> print(cache)
+    DecodeCache(size=2, entries=2, hits=1, misses=4, evictions=2, hit rate=20.0%)
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, instruction):
+        '''
+        Return cached result for instruction, or None
+        '''
+        try:
+            decoded = self.entries[instruction]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(instruction)
+        self.hits += 1
+        return decoded
+
+    def put(self, instruction, decoded):
+        '''
+        Cache and return result, evicting the least recently used if full
+        '''
+        self.entries[instruction] = decoded
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return decoded
+
+    def clear(self):
+        '''
+        Empty the cache and reset the counters
+        '''
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        '''
+        Fraction of lookups found in the cache
+        '''
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return '%s(size=%d, entries=%d, hits=%d, misses=%d, evictions=%d,' \
+               ' hit rate=%.1f%%)' % (type(self).__name__, self.size,
+                                      len(self.entries), self.hits,
+                                      self.misses, self.evictions,
+                                      self.hit_rate * 100)
+
+DECODED = DecodeCache(DECODE_CACHE_SIZE)
+
+class Trap(Exception):
+    '''
+    Exception raised by the emulated program, stopping emulation
+    '''
+
+class ArithmeticOverflow(Trap):
+    '''
+    Integer overflow in a trapping instruction such as `add`
+    '''
+
+class AssemblyError(ValueError):
+    '''
+    Error in an assembly source operand, or line if known
+
+    Columns count from 1.
+    '''
+    def __init__(self, problem, text, column, line=None):
+        if line is None:
+            where = 'column %d' % column
+        else:
+            where = 'line %d, column %d' % (line, column)
+        super().__init__('%s: %s in %r' % (where, problem, text))
+        self.problem, self.text, self.column = problem, text, column
+
+class Trace(object):
+    '''
+    Binary trace of executed instructions, a TRACE_RECORD each
+
+    With `ring`, only the last `ring` records are kept, and written out
+    when the trace is closed.
+
+    >>> trace = Trace('/dev/null', 2)
+    >>> for pc in range(3):
+    ...     trace.record(pc, 0, 8, pc, 0, 0, TRACE_REGISTER)
+    >>> [TRACE_RECORD.unpack_from(trace.buffer, offset)[0]
+    ...  for offset in (0, TRACE_RECORD.size)], trace.position
+    ([2, 1], 1)
+    >>> trace.close()
+    '''
+    def __init__(self, filespec, ring=None):
+        self.file = open(filespec, 'wb')
+        self.ring = int(ring or 0)
+        self.buffer = bytearray(TRACE_RECORD.size * (self.ring or TRACE_BATCH))
+        self.position = 0  # next record in buffer
+        self.wrapped = False
+
+    def record(self, pc, word, index, value, address, stored, flags):
+        TRACE_RECORD.pack_into(self.buffer, self.position * TRACE_RECORD.size,
+                               pc, word, value, address, stored, index, flags)
+        self.position += 1
+        if self.position * TRACE_RECORD.size == len(self.buffer):
+            if self.ring:
+                self.wrapped = True
+            else:
+                self.file.write(self.buffer)
+            self.position = 0
+
+    def close(self):
+        end = self.position * TRACE_RECORD.size
+        if self.wrapped:
+            self.file.write(self.buffer[end:])
+        self.file.write(self.buffer[:end])
+        self.file.close()
+
+def disassemble(filespec, start=None, end=None, jobs=None):
     '''
     primitive disassembler
+
+    Each word is decoded once, collecting labels as it goes; the text is
+    rendered afterwards, so `start` and `end` offsets can limit output
+    to part of the image without losing labels from the rest of it.
+
+    With `jobs` greater than 1, ranges of the image are decoded in that
+    many worker processes, and their labels merged before rendering.
+    '''
+    lines = disassembly(filespec, start, end, jobs)
+    while True:
+        batch = list(islice(lines, OUTPUT_BATCH))
+        if not batch:
+            break
+        sys.stdout.write('\n'.join(batch) + '\n')
+
+def disassembly(filespec, start=None, end=None, jobs=None):
+    '''
+    generate the lines of assembly language for an image
+
+    This is what `disassemble` prints, for tools that want the lines
+    without going through stdout.
     '''
-    print('.set noat')  # get rid of warnings for using $at register
+    init()
+    yield '.set noat'  # get rid of warnings for using $at register
+    try:
+        jobs = int(jobs or 1)
+    except ValueError:
+        raise ValueError('--jobs must be a number of processes, not %r'
+                         % jobs) from None
     with open(filespec, 'rb') as infile:
-        filedata = infile.read()
+        filedata = mapfile(infile)
         # store labels of b, j, etc. instruction targets, to print later
-    for loop in [0, 1]:
-        for index in range(0, len(filedata), 4):
-            chunk = filedata[index:index + 4]
-            disassemble_chunk(loop, index, chunk, len(filedata))
+        if jobs > 1:
+            records = decode_parallel(filespec, len(filedata), jobs)
+        elif USE_NUMPY and len(filedata) >= NUMPY_MINIMUM:
+            records = decode_image(filedata)
+        else:
+            records = [decode_word(index << 2, instruction, len(filedata))
+                       for index, (instruction,)
+                       in enumerate(struct.iter_unpack('<L', filedata))]
+    logging.info('decode cache: %s', DECODED)
+    # offsets are strings such as '0x100' from the command line
+    start = int(start, 0) if isinstance(start, str) else start or 0
+    end = int(end, 0) if isinstance(end, str) else end
+    end = len(filedata) if end is None else end
+    for record in records:
+        if start <= record[0] < end:
+            yield FORMATTER[record[3]](*record)
+
+def disassemble_word(word, offset='0'):
+    '''
+    print the disassembly of a single word, given in hex, at `offset`
+    '''
+    init()
+    print(render_word(decode_word(int(offset, 0), int(word, 16), 0)))
+
+def decode_parallel(filespec, size, jobs):
+    '''
+    decode an image in word-aligned ranges using a pool of processes
+
+    The labels found by each worker are merged into LABELS, so rendering
+    the records gives the same output as decoding serially.
+    '''
+    words = size >> 2
+    step = max(-(-words // (jobs * 4)), 1) << 2  # a few ranges per worker
+    records = []
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as executor:
+        ranges = [(start, min(start + step, size))
+                  for start in range(0, size, step)]
+        for part, labels in executor.map(decode_range,
+                                         [filespec] * len(ranges),
+                                         *zip(*ranges)):
+            records.extend(part)
+            for offset, label in labels.items():
+                LABELS.setdefault(offset, label)
+    return records
+
+def decode_range(filespec, start, end):
+    '''
+    decode the words between `start` and `end` offsets, in a worker process
+
+    Returns the records and any labels added to this process's LABELS.
+    '''
+    init()
+    before = set(LABELS)
+    with open(filespec, 'rb') as infile:
+        filedata = mapfile(infile)
+        if USE_NUMPY and end - start >= NUMPY_MINIMUM:
+            records = decode_image(filedata, start, end)
+        else:
+            records = [decode_word(index, instruction, len(filedata))
+                       for index, (instruction,)
+                       in zip(range(start, end, 4), struct.iter_unpack(
+                           '<L', memoryview(filedata)[start:end]))]
+    return records, {offset: label for offset, label in LABELS.items()
+                     if offset not in before}
 
 def assemble(filespec):
     '''
-    primitive assembler
+    primitive assembler, writing the image to stdout
     '''
-    outfile = None
     with open(filespec, 'r') as infile:
         filedata = infile.read().splitlines()
-    # first pass, just build labels
-    for loop in range(2):
-        if loop == 1:
-            outfile = sys.stdout.buffer
-            debug = logging.debug
-            logging.debug('labels at start of 2nd pass: %s', LABELS)
+    sys.stdout.buffer.write(assemble_source(filedata)[0])
+
+def assemble_source(filedata, indexed=False):
+    '''
+    assemble lines of source into an image, and an index if `indexed`
+
+    Each line is parsed and assembled once. One using a label not seen yet
+    goes on a list of fixups, assembled when all labels are known, and
+    patched into the image.
+
+    The index, for reassemble(), has the offset of each line, whether it
+    made an instruction, the labels and which line defines each, and for
+    lines that use labels, which.
+    '''
+    init()
+    image = bytearray(4 * len(filedata))  # no line makes more than a word
+    labels, fixups, offset = {}, [], 0
+    offsets, emits, definitions = array('L'), bytearray(len(filedata)), {}
+    operands = []
+    for lineno, line in enumerate(filedata, 1):
+        match = LINEMATCH(line)
+        if not match:
+            raise ValueError('No match for regex %r to line %r' %
+                             (LINEPATTERN, line))
+        fields = match.groupdict()
+        label = fields.pop('label')
+        if label:
+            if label in labels:
+                raise ValueError('Label %r already defined as %r' %
+                                 (label, labels[label]))
+            labels[label] = offset
+            definitions[lineno - 1] = label
+        record = (lineno, line, offset, fields)
+        if indexed:
+            offsets.append(offset)
+        instruction = assemble_line(labels, record, strict=False)
+        if instruction is None:
+            continue
+        if instruction == PENDING:
+            fixups.append(record)
         else:
-            debug = lambda *args, **kwargs: None
-        offset = 0
-        for line in filedata:
-            label = None
-            match = re.match(LINEPATTERN, line)
-            if match:
-                label = match.group('label')
-            else:
-                raise ValueError('No match for regex %r to line %r' %
-                                 (LINEPATTERN, line))
-            #logging.debug('match: %s', match.groupdict())
-            instruction, emulation = assemble_instruction(
-                loop, offset,
-                **{key: value for key, value
-                    in match.groupdict().items() if key != 'label'})
+            WORD_STRUCT.pack_into(image, offset, instruction)
+        if indexed:
+            emits[lineno - 1] = 1
+            if fields['args']:
+                operands.append((lineno - 1, fields['args']))
+        offset += 4
+    if __debug__ and 'assemble' in TRACE:
+        logging.debug('%d labels, %d fixups', len(labels), len(fixups))
+    for record in fixups:
+        WORD_STRUCT.pack_into(image, record[2],
+                              assemble_line(labels, record, strict=True))
+    del image[offset:]
+    if not indexed:
+        return image, None
+    references = {}
+    for number, args in operands:
+        names = [term for term in TERM.findall(args) if term in labels]
+        if names:
+            references[number] = names
+    return image, {'offsets': offsets.tobytes(), 'emits': bytes(emits),
+                   'labels': labels, 'definitions': definitions,
+                   'references': references}
+
+def reassemble(filespec, imagespec):
+    '''
+    incremental assembler, patching an image from an earlier run in place
+
+    A sidecar index, imagespec + '.index', holds a hash of each source
+    line and what assemble_source() indexed. Only changed lines, and lines
+    using a label that was added or dropped, are assembled again. Should
+    offsets move, with lines added or removed, or a changed line making an
+    instruction where it didn't or vice versa, all is assembled afresh.
+    '''
+    init()
+    started = time.time()
+    with open(filespec, 'r') as infile:
+        filedata = infile.read().splitlines()
+    hashes = [hashlib.blake2b(line.encode(), digest_size=8).digest()
+              for line in filedata]
+    indexspec = imagespec + '.index'
+    try:
+        with open(indexspec, 'rb') as infile:
+            index = marshal.load(infile)
+        status = os.stat(imagespec)
+        if index['image'] != (status.st_size, status.st_mtime_ns):
+            raise ValueError('%s changed since %s' % (imagespec, indexspec))
+        if len(index['hashes']) != len(hashes):
+            raise ValueError('lines were added or removed')
+        count = patch_image(imagespec, filedata, hashes, index)
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as reason:
+        logging.info('assembling all of %s: %s', filespec, reason)
+        count = None
+    if count is None:
+        image, index = assemble_source(filedata, indexed=True)
+        with open(imagespec, 'wb') as outfile:
+            outfile.write(image)
+        count = len(filedata)
+    status = os.stat(imagespec)
+    index.update(hashes=hashes, image=(status.st_size, status.st_mtime_ns))
+    with open(indexspec, 'wb') as outfile:
+        marshal.dump(index, outfile)
+    logging.info('assembled %d of %d lines in %.3f seconds', count,
+                 len(filedata), time.time() - started)
+
+def patch_image(imagespec, filedata, hashes, index):
+    '''
+    assemble changed lines into the image, updating the index
+
+    Returns the number of lines assembled, or None if offsets would move.
+    Lines are matched to the index by number, so none may have been
+    added or removed.
+    '''
+    offsets = array('L', index['offsets'])
+    emits, labels = index['emits'], index['labels']
+    definitions, references = index['definitions'], index['references']
+    changed = [number for number, (old, new)
+               in enumerate(zip(index['hashes'], hashes)) if old != new]
+    records, defined, renamed = {}, {}, set()
+    for number in changed:
+        line = filedata[number]
+        match = LINEMATCH(line)
+        if not match:
+            raise ValueError('No match for regex %r to line %r' %
+                             (LINEPATTERN, line))
+        fields = match.groupdict()
+        label = fields.pop('label')
+        if label != definitions.get(number):
+            if number in definitions:
+                renamed.add(definitions[number])
+                del labels[definitions.pop(number)]
+            if label:
+                defined[number] = label
+        records[number] = (number + 1, line, offsets[number], fields)
+    for number, label in defined.items():  # once all dropped labels are gone
+        if label in labels:
+            raise ValueError('Label %r already defined as %r' %
+                             (label, labels[label]))
+        renamed.add(label)
+        labels[label] = offsets[number]
+        definitions[number] = label
+    for number, names in references.items():
+        if number not in records and renamed.intersection(names):
+            line = filedata[number]
+            fields = LINEMATCH(line).groupdict()
+            del fields['label']
+            records[number] = (number + 1, line, offsets[number], fields)
+    with open(imagespec, 'r+b') as outfile:
+        for number, record in sorted(records.items()):
+            instruction = assemble_line(labels, record)
+            if (instruction is None) == bool(emits[number]):
+                return None
             if instruction is not None:
-                if outfile is not None:
-                    debug('assembled instruction: 0x%08x', instruction)
-                    try:
-                        outfile.write(struct.pack('<L', instruction))
-                    except TypeError:
-                        raise(TypeError('Cannot write bytes to %s' % outfile))
-                elif label:
-                    if label in LABELS:
-                        raise ValueError('Label %r already in LABELS as %r' %
-                                         (label, LABELS[label]))
-                    LABELS[label] = offset
-                offset += 4
-                debug('offset now: %s', hex(offset))
+                outfile.seek(record[2])
+                outfile.write(WORD_STRUCT.pack(instruction))
+            args = record[3]['args'] or ''
+            names = [term for term in TERM.findall(args) if term in labels]
+            if names:
+                references[number] = names
+            else:
+                references.pop(number, None)
+    return len(records)
+
+def assemble_line(labels, record, strict=True):
+    '''
+    assemble a (lineno, line, offset, fields) record made by assemble()
+
+    Errors in operands are raised with their line and column.
+    '''
+    lineno, line, offset, fields = record
+    try:
+        return assemble_instruction(labels, offset, strict=strict, **fields)
+    except AssemblyError as problem:
+        start = LINEMATCH(line).start('args')
+        column = max(line.find(problem.text, start), 0)
+        raise AssemblyError(problem.problem, line,
+                            column + problem.column, lineno) from None
 
 def disassemble_chunk(loop, index, chunk, maxoffset):
     '''
-    build labels dict in first loop, output assembly language in second
+    disassemble a single word, printing it in the second loop
     '''
     instruction = struct.unpack('<L', chunk)[0]
-    chunkstring = repr(chunk)[1:]  # to make assembly output match python2
-    logging.debug('chunk: %r, instruction: 0x%08x', chunk, instruction)
-    label = LABELS.get(index, '')
-    label += ':' if label else ''
-    comment = ''
-    opcode = instruction >> 26  # high 6 bits
-    mnemonic, style, labeled, condition, signed = INSTRUCTION[opcode][:5]
-    source = (instruction & 0x03e00000) >> 21  # 5 bits, 0-31
-    rs = REGISTER[source]
-    target = (instruction & 0x001f0000) >> 16  # next 5 bits
-    rt = REGISTER[target]
-    floatrt = FLOATREG[target]
-    altrt = ALTREG[target]
-    dest = (instruction & 0x0000f800) >> 11  # next 5 bits
-    rd = REGISTER[dest]
-    floatrs = FLOATREG[dest]
-    amount = (instruction & 0x000007c0) >> 6  # next 5 bits
-    floatrd = FLOATREG[amount]
-    code = (instruction & 0x0000ffc0) >> 6 # dest and amount combined
-    longcode = (instruction & 0x03ffffc0) >> 6  # 20 bit code for syscall
-    codehigh = longcode >> 10  # for breakpoints
-    function = instruction & 0x0000003f  # low 6 bits
-    immediate = instruction & 0x0000ffff  # low 16 bits
-    longimmediate = ((instruction & 0x03ffffff) << 2)  # low 26 bits
-    # longimmediate for jal[x] is shifted by 2
-    # and low bit is set to 1 for jalx but can't find that in documentation
-    jalximmediate = longimmediate | 1
-    co = (instruction & 0x02000000) >> 25  # coprocessor control bit
-    jump = instruction & 0x03ffffff
-    sel = instruction & 0b111  # selector bits for m[ft]b[0-3]
-    mtzero = instruction & 0b11111111000 # coprocessor moveto requires zero
-    if mnemonic == 'SPECIAL':
-        mnemonic, style, labeled, condition, signed = SPECIAL[function][:5]
-    if mnemonic == 'SPECIAL2':
-        mnemonic, style, labeled, condition, signed = SPECIAL2[function][:5]
-    elif mnemonic == 'REGIMM':
-        mnemonic, style, labeled, condition, signed = REGIMM[target][:5]
-    elif mnemonic.startswith('COP'):
-        coprocessor = int(mnemonic[-1:])
-        coregister = (
-            COREGISTER.get(dest, '$%d' % dest),
-            '$f%d' % dest,
-            '$%d' % dest,
-            '$%d' % dest
-        )[coprocessor]
-        listing = INSTRUCTIONS[mnemonic]
-        longimmediate = (instruction & 0x1ffffff)  # low 25 bits
-        mnemonic, style, labeled, condition, signed = listing[source][:5]
-    if not eval(condition):
-        logging.debug("failed condition %s, converting %r to '.word': %s",
-                      condition, mnemonic, shorten(locals()))
-        mnemonic, style, labeled, condition, signed = WORD
-    if signed and not style.endswith('x'):
-        immediate = ctypes.c_short(immediate).value
-    # the jump offset is immediate * 4 added to the *following* instruction
-    offset = index + 4 + (immediate << 2)
-    # don't use labels until we've ascertained that output is like objdump
+    line = render_word(decode_word(index, instruction, maxoffset))
+    if loop == 1:
+        print(line)
+    return line
+
+def decode_word(index, instruction, maxoffset):
+    '''
+    decode a word into a record for render_word, adding any label to LABELS
+
+    The record is a tuple of (index, instruction, mnemonic, style,
+    immediate, longimmediate, offset, comment); register names and the
+    branch destination are looked up at rendering time.
+    '''
+    if __debug__ and 'disassemble' in TRACE:
+        logging.debug('index: 0x%x, instruction: 0x%08x', index, instruction)
+    (mnemonic, style, immediate, longimmediate, comment, labeled,
+     machine) = decode_instruction(instruction)
+    # the jump offset is immediate * 4 added to the *following* instruction
+    offset = index + 4 + (immediate << 2)
+    if USE_LABELS and labeled and offset not in LABELS and offset <= maxoffset:
+        LABELS[offset] = 's%s' % hex(offset).lstrip('0x')
+        #logging.debug('LABELS: %s', LABELS)
+    return (index, instruction, mnemonic, style, immediate, longimmediate,
+            offset, comment)
+
+def decode_instruction(instruction):
+    '''
+    position-independent decoding of a word, from DECODED if possible
+    '''
+    decoded = DECODED.get(instruction)
+    if decoded is None:
+        decoded = DECODED.put(instruction, decode_fields((
+            instruction,
+            (instruction & 0x03e00000) >> 21,  # source, 5 bits, 0-31
+            (instruction & 0x001f0000) >> 16,  # target, next 5 bits
+            (instruction & 0x0000f800) >> 11,  # dest, next 5 bits
+            (instruction & 0x000007c0) >> 6,  # amount, next 5 bits
+            (instruction & 0x0000ffc0) >> 6,  # code, dest and amount combined
+            (instruction & 0x03ffffc0) >> 6,  # longcode, 20 bits for syscall
+            instruction & 0x0000003f,  # function, low 6 bits
+            (instruction & 0x03ffffff) << 2,  # longimmediate, low 26 bits
+            instruction & 0b111,  # sel, selector bits for m[ft]b[0-3]
+            instruction & 0b11111111000,  # mtzero, moveto requires zero
+        )))
+    return decoded
+
+def decode_image(filedata, start=0, end=None):
+    '''
+    numpy version of decode_word for a whole image, or a range of it
+
+    Each distinct word is decoded only once, and the results spread back
+    over the image with a few vector operations, which also find the
+    branch labels in bulk.
+    '''
+    import numpy
+    end = len(filedata) if end is None else end
+    if (end - start) & 3:
+        # the same error as struct.iter_unpack without numpy
+        raise struct.error('iterative unpacking requires a buffer'
+                           ' of a multiple of 4 bytes')
+    words = numpy.frombuffer(filedata, dtype='<u4',
+                             count=(end - start) >> 2, offset=start)
+    unique, inverse = numpy.unique(words, return_inverse=True)
+    decoded = [decode_instruction(word) for word in unique.tolist()]
+    if not decoded:
+        return []
+    (mnemonics, styles, immediates, longimmediates, comments,
+     labeled) = (numpy.array(list(map(itemgetter(field), decoded)),
+                             dtype=dtype)[inverse]
+                 for field, dtype in enumerate((object, object, numpy.int64,
+                                                numpy.int64, object, bool)))
+    offsets = numpy.arange(start, end, 4, dtype=numpy.int64)
+    destinations = offsets + 4 + (immediates << 2)
     if USE_LABELS:
-        destination = LABELS.get(offset, hex(offset))
-    else:
-        destination = hex(offset)
+        wanted = labeled & (destinations <= len(filedata))
+        for offset in numpy.unique(destinations[wanted]).tolist():
+            LABELS.setdefault(offset, 's%s' % hex(offset).lstrip('0x'))
+    return list(zip(offsets.tolist(), words.tolist(), mnemonics.tolist(),
+                    styles.tolist(), immediates.tolist(),
+                    longimmediates.tolist(), destinations.tolist(),
+                    comments.tolist()))
+
+def decode_fields(fields):
+    '''
+    decode the fields of a word, in CONDITION_ARGS order, for decode_word
+
+    The result does not depend on where the word is, so it can be cached:
+    (mnemonic, style, immediate, longimmediate, comment, labeled, machine),
+    `labeled` being whether a branch destination should get a label, and
+    `machine` the mnemonic before any conversion to a pseudo-op.
+    '''
+    (instruction, source, target, dest, amount, code, longcode,
+     function, longimmediate, sel, mtzero) = fields
+    comment = ''
+    opcode = instruction >> 26  # high 6 bits
+    mnemonic, style, labeled, condition, signed = INSTRUCTION[opcode][:5]
+    immediate = instruction & 0x0000ffff  # low 16 bits
+    if mnemonic == 'SPECIAL':
+        mnemonic, style, labeled, condition, signed = SPECIAL[function][:5]
+    if mnemonic == 'SPECIAL2':
+        mnemonic, style, labeled, condition, signed = SPECIAL2[function][:5]
+    elif mnemonic == 'REGIMM':
+        mnemonic, style, labeled, condition, signed = REGIMM[target][:5]
+    elif mnemonic.startswith('COP'):
+        listing = INSTRUCTIONS[mnemonic]
+        longimmediate = (instruction & 0x1ffffff)  # low 25 bits
+        fields = fields[:8] + (longimmediate,) + fields[9:]
+        mnemonic, style, labeled, condition, signed = listing[source][:5]
+    if not CONDITIONS[condition](*fields):
+        if __debug__ and 'disassemble' in TRACE:
+            logging.debug("failed condition %s, converting %r to '.word': %s",
+                          condition, mnemonic, shorten(locals()))
+        mnemonic, style, labeled, condition, signed = WORD
+    if signed and not style.endswith('x'):
+        immediate = ctypes.c_short(immediate).value
+    machine = mnemonic  # before any conversion to a pseudo-op
     if mnemonic in CONVERSION:
         try:
             for condition, result in CONVERSION[mnemonic]:
-                if eval(condition):
+                if CONDITIONS[condition](*fields):
                     comment += ' (from %r)' % mnemonic
                     mnemonic, style, labeled, condition, signed = result
                     break
                 else:
-                    logging.debug('eval %r failed in %s', condition,
-                                  shorten(locals()))
+                    if __debug__ and 'disassemble' in TRACE:
+                        logging.debug('eval %r failed in %s', condition,
+                                      shorten(locals()))
         except ValueError:
             raise ValueError('CONVERSION[%r] improperly formatted: %s' %
                              (mnemonic, CONVERSION[mnemonic]))
-    if USE_LABELS and labeled and offset not in LABELS and offset <= maxoffset:
-        LABELS[offset] = 's%s' % hex(offset).lstrip('0x')
-        #logging.debug('LABELS: %s', LABELS)
-    pattern = PATTERN[style]
-    line = pattern % locals()
-    if loop == 1:
-        print(line)
-    return line
+    return mnemonic, style, immediate, longimmediate, comment, labeled, machine
+
+def render_word(record):
+    '''
+    format a record from decode_word as a line of assembly language
+    '''
+    return FORMATTER[record[3]](*record)
 
 def init():
+    '''
+    Fill in the derived tables, from TABLE_CACHE if possible, and STATE
+
+    Only the first call does anything.
+    '''
+    if STATE:
+        return
+    cachefile = table_cache()
+    if not load_tables(cachefile):
+        derive_tables()
+        save_tables(cachefile)
+    # STATE is used only by emulator, but initialize it anyway because it
+    # makes sure all the registers are created correctly and in order
+    STATE[REGISTER[0]] = ZeroRegister('$zero', 0)
+    STATE[COREGISTER[0]] = CoprocessorRegister(0, COREGISTER[0], 0)
+    for index in range(1, len(REGISTER)):
+        STATE[REGISTER[index]] = Register(REGISTER[index], index)
+        STATE[COREGISTER[index]] = CoprocessorRegister(0,
+                                                       COREGISTER[index],
+                                                       index)
+    STATE['hi'] = Register('hi', len(REGISTER))
+    STATE['lo'] = Register('lo', len(REGISTER) + 1)
+
+def derive_tables():
     '''
     Fill in some missing info in global structures
     
@@ -2471,6 +3153,8 @@ def init():
     else:
         # need to be able to interpret register $s8 when assembling
         REGISTER_REFERENCE['$s8'] = REGISTER.index('$fp')
+    compile_conditions()
+    compile_formatters()
     REGISTER_REFERENCE.update({value: key for key, value
                                in COREGISTER.items()
                                if value.startswith('c')
@@ -2487,16 +3171,198 @@ def init():
                 raise ValueError(
                     'REFERENCE[%r] fields are incorrect: %d != 32' %
                     (key, length))
-    # STATE is used only by emulator, but initialize it anyway because it
-    # makes sure all the registers are created correctly and in order
-    STATE[REGISTER[0]] = ZeroRegister('$zero', 0)
-    for index in range(1, len(REGISTER)):
-        STATE[REGISTER[index]] = Register(REGISTER[index], index)
-        logging.debug('Creating COP0 register %s (%d)',
-                      COREGISTER[index], index)
-        STATE[COREGISTER[index]] = CoprocessorRegister(0,
-                                                       COREGISTER[index],
-                                                       index)
+            if 'args' in item:
+                ENCODERS[key] = encoder(key, item['fields'])
+    for key, item in REFERENCE.items():
+        if 'fields' in item and 'emulation' in item:
+            OPERANDS[key] = operands(key, item['fields'])
+    compile_emulation()
+
+def table_cache():
+    '''
+    path of the table cache for this source and these settings, or None
+    '''
+    if not TABLE_CACHE:
+        return None
+    return os.path.join(TABLE_CACHE, 'mips.%s.tables' % table_key().hex())
+
+def table_key():
+    '''
+    8-byte hash of what the derived tables depend on
+
+    That is this file, which has all the source tables and the code
+    deriving from them, and the settings that change what is derived.
+    '''
+    key = hashlib.blake2b(digest_size=8)
+    with open(__file__, 'rb') as infile:
+        key.update(infile.read())
+    key.update(repr((sys.version, MATCH_OBJDUMP_DISASSEMBLY, USE_LABELS,
+                     INTCTLVS, VECTORS)).encode())
+    return key.digest()
+
+def save_tables(cachefile):
+    '''
+    save the DERIVED_TABLES to the table cache, if there is one, in place
+    of any saved before with another table_key()
+    '''
+    if cachefile is None:
+        return
+    # each process writes its own file, so concurrent init()s don't mix
+    temporary = '%s.%d.tmp' % (cachefile, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        with open(temporary, 'wb') as outfile:
+            marshal.dump({name: globals()[name] for name in DERIVED_TABLES},
+                         outfile)
+        os.replace(temporary, cachefile)
+    except OSError as problem:
+        logging.info('not caching tables: %s', problem)
+        return
+    # tables of older sources or other settings would only pile up
+    directory, current = os.path.split(cachefile)
+    for filename in os.listdir(directory):
+        if (filename.startswith('mips.') and filename.endswith('.tables')
+                and filename != current):
+            try:
+                os.unlink(os.path.join(directory, filename))
+            except OSError:
+                pass  # gone already, or not ours to remove
+
+def load_tables(cachefile):
+    '''
+    load the DERIVED_TABLES from the table cache, returning True if done
+
+    The tables are updated in place, as other tables refer to them, and
+    the compiled code is turned back into functions.
+    '''
+    try:
+        with open(cachefile, 'rb') as infile:
+            tables = marshal.load(infile)
+    except (TypeError, OSError, EOFError, ValueError):
+        return False
+    for name in DERIVED_TABLES:
+        table = globals()[name]
+        if isinstance(table, list):
+            table[:] = tables[name]
+        else:
+            table.clear()
+            table.update(tables[name])
+    for (name, key), code in COMPILED.items():
+        if name == 'EMULATION':
+            namespace = {}
+            exec(code, globals(), namespace)
+            EMULATION[key], = namespace.values()
+        else:
+            globals()[name][key] = eval(code)
+    return True
+
+def compile_conditions():
+    '''
+    Turn every 'condition' string in the tables into a function, once
+
+    The functions take the instruction fields in CONDITION_ARGS order,
+    so disassemble_chunk need not `eval` anything per word.
+
+    >>> CONDITIONS['source == target == 0'](0, 0, 0, 5, 0, 0, 0, 0, 0, 0, 0)
+    True
+    '''
+    conditions = set()
+    for listing in [INSTRUCTION, [WORD]] + list(INSTRUCTIONS.values()):
+        conditions.update(item[3] for item in listing)
+    for conversions in CONVERSION.values():
+        for condition, result in conversions:
+            conditions.update([condition, result[3]])
+    for condition in conditions:
+        code = compile(condition, '<condition>', 'eval')
+        unknown = set(code.co_names) - set(CONDITION_ARGS)
+        if unknown:
+            raise ValueError('Condition %r uses unknown field(s) %s' %
+                             (condition, sorted(unknown)))
+        code = COMPILED['CONDITIONS', condition] = compile(
+            'lambda %s: %s' % (', '.join(CONDITION_ARGS), condition),
+            '<condition>', 'eval')
+        CONDITIONS[condition] = eval(code)
+
+def compile_emulation():
+    '''
+    Turn every 'emulation' snippet in REFERENCE into a function, once
+
+    The functions take pc, hi, lo, then the variable fields of the
+    instruction in OPERANDS order, so the emulator need not `exec` anything
+    per word. Errors in the snippets are thus reported at startup.
+
+    >>> EMULATION['addiu'].__code__.co_varnames[:6]
+    ('pc', 'hi', 'lo', 'rs', 'rt', 'immediate')
+    '''
+    for name, item in REFERENCE.items():
+        if 'emulation' not in item:
+            continue
+        function = 'emulate_' + re.sub(r'\W', '_', name)
+        args = ['pc', 'hi', 'lo'] + [operand[0]
+                                     for operand in OPERANDS.get(name, [])]
+        source = 'def %s(%s):\n    %s\n' % (
+            function, ', '.join(args), '\n    '.join(item['emulation']))
+        try:
+            code = compile(source, '<emulation of %s>' % name, 'exec')
+        except SyntaxError as problem:
+            raise SyntaxError('REFERENCE[%r] emulation: %s' % (name, problem))
+        namespace = {}
+        exec(code, globals(), namespace)
+        EMULATION[name] = namespace[function]
+        COMPILED['EMULATION', name] = code
+        if {'mips_branch', 'mips_jump'} & set(code.co_consts[0].co_names):
+            TRANSFERS.add(function)
+        # with numbered arguments and register values as REGFILE items,
+        # for inlining into basic blocks
+        tree = ast.parse(source).body[0]
+        args = [arg.arg for arg in tree.args.args]
+        names = {node.id for node in ast.walk(tree)
+                 if isinstance(node, ast.Name)}
+        if names - set(code.co_consts[0].co_varnames) - set(globals()) - set(
+                vars(builtins)):
+            UNIMPLEMENTED.add(name)  # uses something not written yet
+        tree = IndexRegisters(args).visit(tree)
+        tree = BindNames({arg: arg + '_INDEX_' for arg in args}).visit(tree)
+        SNIPPETS[function] = (args, ast.unparse(tree.body).splitlines())
+    SNIPPETS['mips_unknown'] = (
+        ['pc', 'instruction'], ['mips_unknown(pc_INDEX_, instruction_INDEX_)'])
+
+def mapfile(infile):
+    '''
+    Map an open file into memory read-only, rather than reading a copy
+
+    Pipes and other streams cannot be mapped, so they are read instead,
+    as are empty files.
+    '''
+    status = os.fstat(infile.fileno())
+    if not stat.S_ISREG(status.st_mode) or status.st_size == 0:
+        return infile.read()
+    return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def compile_formatters():
+    r'''
+    Turn each PATTERN into a function taking a record from decode_word
+
+    Only the fields the pattern uses are computed, and the string is
+    formatted from a tuple rather than from a dict of `locals()`.
+
+    >>> FORMATTER['jump'](8, 0x10000003, 'b', 'jump', 3, 0, 24, '').split()
+    ['b', '0x18', '#', '8:', "'\\x03\\x00\\x00\\x10'"]
+    '''
+    COREGISTERS[:] = [
+        [COREGISTER.get(number, '$%d' % number) for number in range(32)],
+        ['$f%d' % number for number in range(32)],
+        ['$%d' % number for number in range(32)],
+        ['$%d' % number for number in range(32)],
+    ]
+    for style, pattern in PATTERN.items():
+        names = re.findall(r'%\((\w+)\)', pattern)
+        source = 'lambda %s: %r %% (%s,)' % (
+            ', '.join(RECORD_FIELDS), re.sub(r'%\(\w+\)', '%', pattern),
+            ', '.join('(%s)' % FIELD_EXPRESSION[name] for name in names))
+        code = COMPILED['FORMATTER', style] = compile(source, '<pattern>',
+                                                     'eval')
+        FORMATTER[style] = eval(code)
 
 def shorten(hashtable):
     '''
@@ -2519,7 +3385,8 @@ def buildargs(provided, expected):
     given = argsplit(provided)
     wanted = argsplit(expected[index])
     desired = list(wanted)
-    logging.debug('buildargs: given: %s, wanted: %s', given, wanted)
+    if __debug__ and 'args' in TRACE:
+        logging.debug('buildargs: given: %s, wanted: %s', given, wanted)
     # insert any default args where needed
     # this only works left-to-right, if a different order is needed,
     # priority will need to be specified and used.
@@ -2529,10 +3396,13 @@ def buildargs(provided, expected):
             desired = argsplit(expected[index][0])
         except IndexError:
             raise(IndexError('No index [%d][0] in %s' % (index, expected)))
-        logging.debug('buildargs calling rebuildargs: %s', expected[index])
+        if __debug__ and 'args' in TRACE:
+            logging.debug('buildargs calling rebuildargs: %s', expected[index])
         provided = rebuildargs(provided, *expected[index])
         given = argsplit(provided)
-        logging.debug('buildargs loop: given: %s, wanted: %s', given, wanted)
+        if __debug__ and 'args' in TRACE:
+            logging.debug('buildargs loop: given: %s, wanted: %s',
+                          given, wanted)
     return dict(zip(wanted, given))
     
     return OrderedDict(zip(wanted, given))
@@ -2550,120 +3420,154 @@ def rebuildargs(args, pseudoop_args, newargs):
     >>> rebuildargs('', '', '0,0')
     '0,0'
     '''
-    logging.debug('rebuildargs args: %s', locals())
+    if __debug__ and 'args' in TRACE:
+        logging.debug('rebuildargs args: %s', locals())
     argslist = [argsplit(string) for string in (args, pseudoop_args, newargs)]
-    logging.debug('argslist before rebuild: %s', argslist)
+    if __debug__ and 'args' in TRACE:
+        logging.debug('argslist before rebuild: %s', argslist)
     if len(argslist[0]) != len(argslist[1]):
         raise ValueError('Length mismatch: %s' % argslist[:2])
     for index in range(len(argslist[2])):
         arg = argslist[2][index]
         if arg in argslist[1]:
             argslist[2][index] = argslist[0][argslist[1].index(arg)]
-    logging.debug('argslist after rebuild: %s', argslist)
+    if __debug__ and 'args' in TRACE:
+        logging.debug('argslist after rebuild: %s', argslist)
     return ','.join(argslist[2])
 
 def argsplit(args):
     '''
-    split string using ARGSEP.
+    split string using ARGSEP, keeping %hi() and %lo() operands whole
 
     special case for None, return empty list
+    >>> argsplit('$a0,%lo(buffer+4)($sp)')
+    ['$a0', '%lo(buffer+4)', '$sp', '']
     '''
     try:
-        return re.compile(ARGSEP).split(args)
+        if '%' not in args:
+            return ARGSPLIT(args)
     except TypeError:
         return []
+    relocations = iter(RELOCATION.findall(args))
+    return [piece.replace('\0', next(relocations)) if '\0' in piece else piece
+            for piece in ARGSPLIT(RELOCATION.sub('\0', args))]
+
+def evaluate(text, labels=None, strict=True):
+    '''
+    value of a numeric operand, scanned once and without `eval`
+
+    That is a hex or decimal number or a label, or a sum or difference of
+    these, optionally negated, and optionally the argument of %hi() or
+    %lo(). An unknown label is an error if `strict`, else the value is None.
+
+    >>> evaluate('-0x10'), evaluate('12'), evaluate('s40+8', {'s40': 0x40})
+    (-16, 12, 72)
+    >>> evaluate('%hi(0x1234f000)'), evaluate('%lo(0x1234f000)')
+    (4661, 61440)
+    >>> evaluate('later-4', {}, strict=False) is None
+    True
+    >>> evaluate('0x12g')
+    Traceback (most recent call last):
+      ...
+    mips.AssemblyError: column 5: unexpected 'g' in '0x12g'
+    '''
+    position, end, total, sign, known = 0, len(text), 0, 1, True
+    relocation = text[:4]
+    if relocation in ('%hi(', '%lo('):
+        if text[-1:] != ')':
+            raise AssemblyError("missing ')'", text, end + 1)
+        position, end = 4, end - 1
+    elif text[:1] == '-':
+        position, sign = 1, -1
+    while True:
+        match = TERM.match(text, position, end)
+        if match is None:
+            raise AssemblyError('expected number or label', text, position + 1)
+        term = match.group()
+        if term[:2] in ('0x', '0X'):
+            total += sign * int(term, 16)
+        elif term[0].isdigit():
+            total += sign * int(term)
+        elif labels and term in labels:
+            total += sign * labels[term]
+        elif strict:
+            raise AssemblyError('unknown label %r' % term, text, position + 1)
+        else:
+            known = False
+        position = match.end()
+        if position == end:
+            break
+        if text[position] not in '+-':
+            raise AssemblyError('unexpected %r' % text[position], text,
+                                position + 1)
+        sign = 1 if text[position] == '+' else -1
+        position += 1
+    if not known:
+        return None
+    if relocation == '%hi(':
+        return ((total + 0x8000) >> 16) & 0xffff  # lo is added sign-extended
+    if relocation == '%lo(':
+        return total & 0xffff
+    return total
 
 def smart_mask(number, name, offset, argsdict, maskbits):
     '''
     Calculate branch targets/offsets differently
     '''
-    logging.debug('smart_mask(%s, %r, %s, %r)',
-                  hex(number), name, argsdict, maskbits)
+    if __debug__ and 'assemble' in TRACE:
+        logging.debug('smart_mask(%s, %r, %s, %r)',
+                      hex(number), name, argsdict, maskbits)
     if number < 0:
         number = (1 << 32) + number  # two's complement
-        logging.debug('negative number now %s', hex(number))
+        if __debug__ and 'assemble' in TRACE:
+            logging.debug('negative number now %s', hex(number))
     if name  == 'offset' and not 'base' in argsdict:
         number = (number - offset - 4) >> 2
-        logging.debug('branch offset now %s', hex(number))
+        if __debug__ and 'assemble' in TRACE:
+            logging.debug('branch offset now %s', hex(number))
     elif name == 'target':
         number >>= 2  # jump targets are *not* PC-relative
-        logging.debug('jump target now %s', hex(number))
+        if __debug__ and 'assemble' in TRACE:
+            logging.debug('jump target now %s', hex(number))
     number = number & maskbits
-    logging.debug('number after mask operation: %s', hex(number))
+    if __debug__ and 'assemble' in TRACE:
+        logging.debug('number after mask operation: %s', hex(number))
     return number & maskbits
 
-def assemble_instruction(loop, offset, mnemonic=None, args=None, was=''):
+def assemble_instruction(labels, offset, mnemonic=None, args=None, was='',
+                         strict=True):
     '''
     Assemble an instruction given the assembly source line
 
-    Return both the assembled instruction and the emulation info to emulator
+    Until `labels` are complete, not `strict`, the instruction may be PENDING.
     '''
-    logging.debug('processing: %s', locals())
+    if __debug__ and 'assemble' in TRACE:
+        logging.debug('processing: %s', locals())
     instruction = 0
     reference = REFERENCE.get(mnemonic)
-    zero = ('$zero','$0','$f0')
     if reference:
-        fieldsdict = {}
-        if {'fields', 'args'}.issubset(reference.keys()):
+        if mnemonic in ENCODERS:
+            instruction, fields = ENCODERS[mnemonic]
             argsdict = buildargs(args, reference['args'])
-            fieldsdict = {key: value for key, value in reference['fields']
-                          if re.compile('[A-Za-z_][A-Za-z0-9_]+').match(key)}
-            for name, value in reference['fields']:
-                logging.debug('assemble_instruction: name %r, value %r',
-                              name, value)
-                fieldlength = len(value)
-                instruction <<= fieldlength
-                mask = (1 << fieldlength) - 1
-                if value.isdigit():
-                    instruction |= int(value, 2)
-                    if name in fieldsdict:
-                        fieldsdict[name] = int(value, 2)
-                else:  # typically 'bbbbb'
-                    try:
-                        arg = argsdict[name]
-                        fieldsdict[name] = arg
-                    except KeyError:
-                        raise KeyError('%r not found in %s' % (name, argsdict))
-                    if arg[:1].startswith(tuple('-0123456789')):
-                        number = eval(arg)
-                        if name in fieldsdict:
-                            fieldsdict[name] = number
-                        logging.debug('before merging number %r: %s',
-                                      arg, hex(instruction))
-                        instruction |= smart_mask(number, name, offset,
-                                                  argsdict, mask)
-                        logging.debug('after merging number %r: %s',
-                                      arg, hex(instruction))
-                    elif arg in LABELS:
-                        if name in fieldsdict:
-                            fieldsdict[name] = LABELS[arg]
-                        logging.debug('before merging label %r (%s): %s',
-                                      arg, hex(LABELS[arg]), hex(instruction))
-                        instruction |= smart_mask(LABELS[arg], name, offset,
-                                                  argsdict, mask)
-                        logging.debug('after merging label %r (%s): %s',
-                                      arg, hex(LABELS[arg]), hex(instruction))
-                    else:
-                        # check for coprocessor register special names
-                        if '_' in arg:
-                            logging.debug('coregister before replacement: %r',
-                                          arg)
-                            arg = arg.replace(arg[arg.index('_') - 1], '%d', 1)
-                            logging.debug('coregister after: %s', arg)
-                        if arg in REGISTER_REFERENCE:
-                            if name in fieldsdict:
-                                fieldsdict[name] = Register(arg)
-                            logging.debug('before %r: %s',
-                                          arg, hex(instruction))
-                            instruction |= REGISTER_REFERENCE[arg]
-                            logging.debug('after %r: %s', arg, hex(instruction))
-                        elif loop == 0:
-                            instruction = 'pending label list completion'
-                            break
-                        else:
-                            logging.error('%r not in REGISTER_REFERENCE %s',
-                                          arg, REGISTER_REFERENCE)
-                            raise ValueError('Cannot process arg %r' % arg)
+            for name, shift, mask, kind in fields:
+                try:
+                    arg = argsdict[name]
+                except KeyError:
+                    raise KeyError('%r not found in %s' % (name, argsdict))
+                if arg[:1] == '$' or '_' in arg:
+                    # check for coprocessor register special names
+                    if '_' in arg:
+                        arg = arg.replace(arg[arg.index('_') - 1], '%d', 1)
+                    if arg not in REGISTER_REFERENCE:
+                        raise AssemblyError('unknown register', arg, 1)
+                    instruction |= REGISTER_REFERENCE[arg] << shift
+                else:
+                    number = evaluate(arg, labels, strict)
+                    if number is None:
+                        instruction = PENDING
+                        break
+                    instruction |= smart_mask(number, name, offset,
+                                              argsdict, mask) << shift
         elif reference.get('action') is not None:
             logging.warning('exec %r', reference['action'])
             try:
@@ -2674,151 +3578,1058 @@ def assemble_instruction(loop, offset, mnemonic=None, args=None, was=''):
         elif reference.get('alias_of') is not None:
             aliases = reference['alias_of']
             expected = reference['args']
-            logging.debug('expected args of aliased parent: %r', expected)
-            logging.debug('dict(aliases): %s', dict(aliases))
+            if __debug__ and 'assemble' in TRACE:
+                logging.debug('expected args of aliased parent: %r', expected)
+                logging.debug('dict(aliases): %s', dict(aliases))
             if was in dict(aliases):
                 newargs = dict(aliases)[was]
                 mnemonic = was
-                logging.debug('found args %s from de-aliased %r', newargs, was)
+                if __debug__ and 'assemble' in TRACE:
+                    logging.debug('found args %s from de-aliased %r',
+                                  newargs, was)
             else:
                 mnemonic, newargs = aliases[0]
-                logging.debug('newargs from default %s', newargs)
-            logging.debug('assemble_instruction calling itself with new args')
-            return assemble_instruction(loop, offset, mnemonic,
+                if __debug__ and 'assemble' in TRACE:
+                    logging.debug('newargs from default %s', newargs)
+            if __debug__ and 'assemble' in TRACE:
+                logging.debug('assemble_instruction calling itself'
+                              ' with new args')
+            return assemble_instruction(labels, offset, mnemonic,
                                         rebuildargs(args, expected, newargs),
-                                        None)
+                                        None, strict)
         else:
             raise NotImplementedError('No action found for %s' % mnemonic)
-        return instruction, (reference.get('emulation'), fieldsdict)
+        return instruction
     else:
         raise NotImplementedError('%s not in REFERENCE' % mnemonic)
 
-def emulate(filespec):
+def emulate(filespec, step=None, budget=None, stop=None, unknown=None,
+            trace=None, ring=None, save=None):
     '''
     primitive MIPS emulator
+
+    The image is loaded at LOAD_ADDRESS and run from there until a trap,
+    such as `break` or `syscall`, then registers and memory are summarized.
+    Code is translated only once, to the functions cached in BLOCKS, or in
+    HANDLERS when stepping. With `step` set, registers are shown and Enter
+    awaited before each instruction.
+
+    For unattended runs, `budget` limits the number of instructions, `stop`
+    is a comma-separated list of addresses to stop at, and `unknown` is
+    the UNKNOWN policy for instructions that can't be emulated.
+
+    With `trace`, each instruction is single-stepped and recorded to that
+    file, or only the last `ring` of them; see decode_trace().
+
+    With `save`, a snapshot of the stopped machine is written to that file.
+    Given a snapshot instead of an image, emulation resumes from it.
     '''
+    init()
+    global UNKNOWN
+    UNKNOWN = unknown or UNKNOWN
+    if UNKNOWN not in ('trap', 'skip', 'raise'):
+        raise ValueError('Unknown instruction policy must be trap, skip'
+                         ' or raise, not %r' % UNKNOWN)
+    STOPS.clear()
+    STOPS.update(int(address, 16) for address in (stop or '').split(',')
+                 if address)
     with open(filespec, 'rb') as infile:
-        filedata = infile.read()
-    MEMORY.extend(filedata)  # mutable copy of filedata, byte-addressable
-    MEMORY.extend(bytes(4096))  # add room for stack (enough?)
-    program = [filedata[i:i + 4] for i in range(0, len(filedata), 4)]
-    pc = 0x8c000000  # program counter on reset
-    index = 0
-    run = False  # setting to True below will run code until error or ^C
-    while True:
-        instruction = disassemble_chunk(0, index, program[index], len(filedata))
-        logging.debug('executing %s', instruction)
-        parts = re.compile(LINEPATTERN).match(instruction)
-        if not parts:
-            raise NotImplementedError('No known way to execute %s', instruction)
-        executable, emulation = assemble_instruction(0, pc,
-                                                     parts.group('mnemonic'),
-                                                     parts.group('args'),
-                                                     parts.group('was'))
-        locals().update(emulation[1])
-        index += 1
-        pc += 4
-        print(STATE.values(), emulation, file=sys.stderr)
-        for code in emulation[0]:
-            exec(code, globals(), locals())
-        if __debug__:
-            pdb.set_trace()
-        elif not run:
-            run = bool(input('Continue -> '))
-            logging.warning('`run` set to %r', run)
+        filedata = mapfile(infile)
+    if filedata[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+        restore(filespec)
+    else:
+        MEMORY.clear()
+        HANDLERS.clear()
+        BLOCKS.clear()
+        CODE_LINES.clear()
+        write_memory(LOAD_ADDRESS, filedata)  # mutable copy of filedata
+        CPU.update(pc=LOAD_ADDRESS, following=LOAD_ADDRESS + 4, count=0,
+                   jump=None, nullify=False)
+    if UART:
+        mmio(int(UART, 16), 4, write=uart_write)
+    # the budget is for this run, not counting instructions before a snapshot
+    budget = sys.maxsize if budget is None else CPU['count'] + int(budget)
+    tracer = Trace(trace, ring) if trace else None
+    started = time.time()
+    try:
+        if int(step or 0) or tracer:
+            single_step(budget, bool(int(step or 0)), tracer)
+        else:
+            run(budget)
+            single_step(budget)  # any instructions left in the budget
+    except Trap as trap:
+        CPU['stopped'] = str(trap)
+        logging.warning('stopped at 0x%08x: %s', CPU['pc'], trap)
+    except Exception as problem:  # an emulation bug, still summarized
+        if isinstance(problem, NotImplementedError) and UNKNOWN == 'raise':
+            raise
+        CPU['stopped'] = 'emulation failed: %r' % problem
+        logging.exception('stopped at 0x%08x', CPU['pc'])
+    finally:
+        if tracer:
+            tracer.close()
+    if save:
+        snapshot(save)
+    elapsed = time.time() - started
+    logging.warning('%d instructions in %.3f seconds, %d per second',
+                    CPU['count'], elapsed, CPU['count'] / (elapsed or 1e-9))
+    print(summary())
+
+def decode_trace(filespec):
+    '''
+    print a trace file written by emulate(), disassembling each instruction
+
+    Each line shows the address and instruction, with any branch
+    destination as an address too, then the register it changed, and the
+    physical address and value of anything it stored.
+    '''
+    init()
+    names = {register.index: name for name, register in STATE.items()}
+    with open(filespec, 'rb') as infile:
+        tracedata = mapfile(infile)
+    lines = []
+    for (pc, word, value, address, stored, index,
+         flags) in TRACE_RECORD.iter_unpack(tracedata):
+        # decoded at the absolute pc, as the trace doesn't record where
+        # the image was loaded; a maxoffset of 0 adds nothing to LABELS
+        line = disassemble_chunk(0, pc, struct.pack('<L', word),
+                                 0).partition('\t#')[0].split(':')[-1]
+        line = '%08x: %-32s' % (pc, ' '.join(line.split()))
+        if flags & TRACE_REGISTER:
+            line += ' %s=%08x' % (names[index], value)
+        if flags & TRACE_STORE:
+            line += ' [%08x]=%08x' % (address, stored)
+        lines.append(line.rstrip())
+        if len(lines) == OUTPUT_BATCH:
+            print('\n'.join(lines))
+            lines = []
+    if lines:
+        print('\n'.join(lines))
+
+def summary():
+    '''
+    compact final state of the machine: where and why it stopped, the
+    nonzero registers, and a checksum of memory to compare runs by
+    '''
+    lines = ['pc %08x after %d instructions: %s' % (
+        CPU['pc'], CPU['count'], CPU.get('stopped', 'running'))]
+    registers = ['%s=%08x' % (name, register.value)
+                 for name, register in STATE.items() if register.value]
+    for index in range(0, len(registers), 6):
+        lines.append(' '.join(registers[index:index + 6]))
+    checksum = 0
+    for number in sorted(MEMORY):
+        checksum = zlib.crc32(struct.pack('<L', number), checksum)
+        checksum = zlib.crc32(MEMORY[number], checksum)
+    lines.append('memory %d pages, crc32 %08x' % (len(MEMORY), checksum))
+    return '\n'.join(lines)
+
+def snapshot(filespec):
+    '''
+    save the state of the machine, for emulate() to resume from
+
+    Pages are written last and page-aligned, so restore() can map them
+    straight from the file. Translated handlers and blocks are not saved,
+    being quickly rebuilt, but decoded instruction words are, along with
+    the table_key() of the tables that decoded them.
+    '''
+    numbers = array('I', sorted(MEMORY))
+    decoded = marshal.dumps(list(DECODED.entries.items()))
+    # pages may still be mapped from the snapshot being replaced
+    temporary = '%s.%d.tmp' % (filespec, os.getpid())
+    with open(temporary, 'wb') as outfile:
+        outfile.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, CPU['pc'],
+                                           CPU['following'], CPU['count'],
+                                           len(REGFILE), len(numbers),
+                                           len(decoded), table_key()))
+        outfile.write(REGFILE.tobytes())
+        outfile.write(numbers.tobytes())
+        outfile.write(decoded)
+        outfile.write(bytes(-outfile.tell() & PAGE_MASK))
+        for number in numbers:
+            outfile.write(MEMORY[number])
+    os.replace(temporary, filespec)
+
+def restore(filespec):
+    '''
+    resume the machine from a snapshot
+
+    The file is mapped copy-on-write, so no page is read until touched,
+    and writes to it are private: any number of runs can start from the
+    same snapshot without changing it. Decoded words are used only if
+    they were decoded with the same tables.
+    '''
+    with open(filespec, 'rb') as infile:
+        filedata = memoryview(mmap.mmap(infile.fileno(), 0,
+                                        access=mmap.ACCESS_COPY))
+    (magic, pc, following, count, registers, pages, decoded,
+     key) = SNAPSHOT_HEADER.unpack_from(filedata)
+    if magic != SNAPSHOT_MAGIC or registers != len(REGFILE):
+        raise ValueError('%s is not a snapshot of this machine' % filespec)
+    offset = SNAPSHOT_HEADER.size
+    REGFILE[:] = array('I', bytes(filedata[offset:offset + registers * 4]))
+    offset += registers * 4
+    numbers = array('I', bytes(filedata[offset:offset + pages * 4]))
+    offset += pages * 4
+    DECODED.clear()
+    if key == table_key():
+        for instruction, fields in marshal.loads(
+                filedata[offset:offset + decoded]):
+            DECODED.put(instruction, fields)
+    else:
+        logging.info('%s was decoded with other tables', filespec)
+    offset += decoded
+    offset += -offset & PAGE_MASK
+    MEMORY.clear()
+    for number in numbers:
+        MEMORY[number] = filedata[offset:offset + PAGE_MASK + 1]
+        offset += PAGE_MASK + 1
+    HANDLERS.clear()
+    BLOCKS.clear()
+    CODE_LINES.clear()
+    CPU.update(pc=pc, following=following, count=count, jump=None,
+               nullify=False)
+
+def run(budget=sys.maxsize):
+    '''
+    execute basic blocks from CPU['pc'] on
+
+    Each block returns the number of instructions it executed. If one
+    fails partway, CPU['pc'] is left at the failing instruction. Returns
+    with CPU['pc'] at a block that would overrun the budget.
+    '''
+    pc, count, blocks, stops = CPU['pc'], CPU['count'], BLOCKS, STOPS
+    try:
+        if CPU['following'] != pc + 4 and count < budget:  # in a delay slot
+            handler = HANDLERS.get(pc) or translate(pc)
+            handler()
+            pc, count = CPU['following'], count + 1
+        while True:
+            if pc in stops:
+                raise Trap('stop address reached')
+            block = blocks.get(pc)
+            if block is None:
+                block = translate_block(pc)
+            if count + block.length > budget:
+                return
+            try:
+                count += block()
+            except Exception as problem:
+                index = block_position(block, problem.__traceback__)
+                pc, count = pc + (index << 2), count + index
+                raise
+            if CPU['jump'] is not None:
+                pc, CPU['jump'] = CPU['jump'], None
+            else:
+                pc = block.end
+    finally:
+        CPU['pc'], CPU['following'], CPU['count'] = pc, pc + 4, count
+
+def single_step(budget=sys.maxsize, interactive=False, tracer=None):
+    '''
+    execute instructions one at a time from CPU['pc'] on
+
+    `following` is the address executed after `pc`, which differs from
+    pc + 4 only for the delay slot of a branch or jump. Handlers signal
+    control transfers through CPU['jump'] and CPU['nullify'].
+
+    A `tracer` is given each instruction, with the first of the registers
+    it could write which changed, and what it stored, if anything.
+    '''
+    pc, count, handlers, stops = CPU['pc'], CPU['count'], HANDLERS, STOPS
+    following = CPU['following']
+    try:
+        while True:
+            if count >= budget:
+                raise Trap('instruction budget spent')
+            if pc in stops:
+                raise Trap('stop address reached')
+            handler = handlers.get(pc)
+            if handler is None:
+                handler = handlers[pc] = translate(pc)
+            if interactive:
+                print(list(STATE.values()), file=sys.stderr)
+                input('0x%08x -> ' % pc)
+            if tracer:
+                # the instruction's own registers, with hi, lo and $ra
+                written = [arg.index for arg in handler.args
+                           if hasattr(arg, 'index')] + [31]
+                before = [REGFILE[index] for index in written]
+                CPU['store'] = None
+            handler()
+            count += 1
+            if tracer:
+                index = value = flags = 0
+                for register, old in zip(written, before):
+                    if REGFILE[register] != old:
+                        index, value = register, REGFILE[register]
+                        flags = TRACE_REGISTER
+                        break
+                address = stored = 0
+                if CPU['store']:
+                    address, stored, size = CPU['store']
+                    stored &= STORE_MASK[min(size, 4)]
+                    flags |= TRACE_STORE
+                tracer.record(pc, mips_load(pc, 0, 4, False), index, value,
+                              address, stored, flags)
+            if CPU['jump'] is not None:
+                pc, following, CPU['jump'] = following, CPU['jump'], None
+            elif CPU['nullify']:  # branch likely not taken skips delay slot
+                pc, following = following + 4, following + 8
+                CPU['nullify'] = False
+            else:
+                pc, following = following, following + 4
+    finally:
+        CPU['pc'], CPU['following'], CPU['count'] = pc, following, count
+
+def translate_block(pc):
+    '''
+    translate the basic block at `pc` to a single function, and cache it
+
+    The block ends after the delay slot of a branch or jump, after
+    BLOCK_LIMIT instructions, or before a word that cannot be executed.
+    '''
+    handlers, lines, namespace = [], [], {}
+    address = pc
+    while len(handlers) < BLOCK_LIMIT and not (handlers and address in STOPS):
+        handler = HANDLERS.get(address)
+        if handler is None:
+            try:
+                handler = HANDLERS[address] = translate(address)
+            except (Trap, NotImplementedError):
+                if not handlers:
+                    raise
+                break  # let it fail when, and if, it is reached
+        handlers.append(handler)
+        address += 4
+        if handler.func.__name__ in TRANSFERS:
+            handlers.append(translate(address))  # the delay slot
+            address += 4
+            break
+    delayed = len(handlers) > 1 and handlers[-2].func.__name__ in TRANSFERS
+    positions = {}
+    for index, handler in enumerate(handlers):
+        if delayed and index == len(handlers) - 1:
+            lines.extend(["        if CPU['nullify']:",
+                          "            CPU['nullify'] = False",
+                          '            return %d' % index])
+        args, snippet = SNIPPETS[handler.func.__name__]
+        suffix = '_%d' % index
+        for arg, value in zip(args, handler.args):
+            namespace[arg + suffix] = value
+            if hasattr(value, 'index'):  # a register, see IndexRegisters
+                namespace[arg + suffix + 'r'] = value.index
+                namespace[arg + suffix + 'w'] = value.index or SINK
+        for line in snippet:
+            lines.append('        ' + line.replace('_INDEX_', suffix))
+            positions[len(lines) + 2] = index  # after the two `def`s
+    lines.append('        return %d' % len(handlers))
+    # bind the operands as closure variables, with the module as globals
+    name = 'block_%08x' % pc
+    source = 'def bind(%s):\n    def %s():\n%s\n    return %s\n' % (
+        ', '.join(namespace), name, '\n'.join(lines), name)
+    scope = {}
+    exec(compile(source, '<%s>' % name, 'exec'), globals(), scope)
+    block = scope['bind'](**namespace)
+    block.end, block.positions = address, positions
+    block.length = len(handlers)
+    BLOCKS[pc] = block
+    for line in range(physical(pc) >> CODE_LINE,
+                      (physical(address - 1) >> CODE_LINE) + 1):
+        CODE_LINES[line].add(pc)
+    return block
+
+class BindNames(ast.NodeTransformer):
+    '''
+    rename variables in an emulation snippet, for inlining into a block
+    '''
+    def __init__(self, names):
+        self.names = names
+
+    def visit_Name(self, node):
+        if node.id in self.names:
+            node.id = self.names[node.id]
+        return node
+
+class IndexRegisters(ast.NodeTransformer):
+    '''
+    replace `.value` of register arguments with items of REGFILE
+
+    Reading `rs.value` becomes REGFILE[rs_INDEX_r], and a plain assignment
+    `rd.value = x` becomes REGFILE[rd_INDEX_w] = x & 0xffffffff, the `w`
+    index of $zero being SINK.
+    '''
+    def __init__(self, args):
+        self.args = args
+
+    def register(self, node, suffix, context):
+        if (isinstance(node, ast.Attribute) and node.attr == 'value' and
+                isinstance(node.value, ast.Name) and
+                node.value.id in self.args):
+            return ast.Subscript(
+                ast.Name('REGFILE', ast.Load()),
+                ast.Name(node.value.id + '_INDEX_' + suffix, ast.Load()),
+                context)
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        if len(node.targets) == 1:
+            target = self.register(node.targets[0], 'w', ast.Store())
+            if target is not None:
+                node.targets = [target]
+                node.value = ast.BinOp(node.value, ast.BitAnd(),
+                                       ast.Constant(0xffffffff))
+        return node
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, ast.Load):
+            replacement = self.register(node, 'r', ast.Load())
+            if replacement is not None:
+                return replacement
+        return self.generic_visit(node)
+
+def block_position(block, traceback):
+    '''
+    index within `block` of the instruction where an exception was raised
+    '''
+    while traceback is not None:
+        if traceback.tb_frame.f_code is block.__code__:
+            return block.positions.get(traceback.tb_lineno, 0)
+        traceback = traceback.tb_next
+    return 0
+
+def invalidate(start, length=4):
+    '''
+    forget translated code at physical `start`, being rewritten
+    '''
+    for line in range(start >> CODE_LINE,
+                      ((start + length - 1) >> CODE_LINE) + 1):
+        if line in CODE_LINES:
+            for pc in CODE_LINES.pop(line):
+                BLOCKS.pop(pc, None)
+                HANDLERS.pop(pc, None)
+
+def physical(address):
+    '''
+    translate a virtual address, with unmapped KSEG0 and KSEG1 folded
+    onto the low 512 MB, and no TLB, so that anything else is unchanged
+
+    >>> hex(physical(0x8c000010)), hex(physical(0xbfc00000))
+    ('0xc000010', '0x1fc00000')
+    '''
+    address &= 0xffffffff
+    if 0x80000000 <= address < 0xc0000000:
+        return address & 0x1fffffff
+    return address
+
+def page(address, allocate=True):
+    '''
+    the page of MEMORY holding physical `address`, allocated on first touch
+    '''
+    number = address >> PAGE_SHIFT
+    memory = MEMORY.get(number)
+    if memory is None and allocate:
+        memory = MEMORY[number] = bytearray(PAGE_MASK + 1)
+    return memory
+
+def read_memory(address, size):
+    '''
+    read `size` bytes from virtual `address`, as zeros where nothing is
+
+    >>> written = write_memory(0x80000ffe, b'1234')
+    >>> read_memory(0xa0000ffe, 4), read_memory(0x1000, 2)
+    (b'1234', b'34')
+    >>> read_memory(0x7fff0000, 2), 0x7fff0 in MEMORY
+    (b'\\x00\\x00', False)
+    '''
+    address = physical(address)
+    offset = address & PAGE_MASK
+    if offset + size <= PAGE_MASK + 1:
+        memory = MEMORY.get(address >> PAGE_SHIFT)
+        if memory is not None and address >> PAGE_SHIFT not in MMIO:
+            return bytes(memory[offset:offset + size])
+    data = bytearray()
+    while len(data) < size:
+        device, length = span(address, size - len(data))
+        if device is not None:
+            data += device[2](address, length).to_bytes(length, 'little')
+        else:
+            memory = page(address, allocate=False)
+            offset = address & PAGE_MASK
+            data += (bytes(length) if memory is None
+                     else memory[offset:offset + length])
+        address += length
+    return bytes(data)
+
+def write_memory(address, data):
+    '''
+    write bytes `data` at virtual `address`, returning the number written
+
+    Bytes around a device in its pages are RAM.
+
+    >>> mmio(0x1fe00008, 4)
+    >>> write_memory(0xbfe00006, b'123456'), read_memory(0xbfe00006, 6)
+    (6, b'12\\x00\\x00\\x00\\x00')
+    >>> MMIO.clear()
+    '''
+    address = physical(address)
+    done = 0
+    while done < len(data):
+        device, length = span(address, len(data) - done)
+        if device is not None:
+            device[3](address, length,
+                      int.from_bytes(data[done:done + length], 'little'))
+        else:
+            offset = address & PAGE_MASK
+            page(address)[offset:offset + length] = data[done:done + length]
+            if address >> CODE_LINE in CODE_LINES or (
+                    (address + length - 1) >> CODE_LINE in CODE_LINES):
+                invalidate(address, length)
+        address += length
+        done += length
+    return done
+
+def span(address, size):
+    '''
+    the device at physical `address`, or None for RAM, and how many of
+    `size` bytes from there go to it, up to the end of the device or page
+    '''
+    length = min(size, PAGE_MASK + 1 - (address & PAGE_MASK))
+    device = MMIO.get(address >> PAGE_SHIFT)
+    if device is None:
+        return None, length
+    start, end = device[:2]
+    if start <= address < end:
+        return device, min(length, end - address)
+    if address < start:
+        return None, min(length, start - address)
+    return None, length
+
+def mmio(start, length, read=None, write=None):
+    '''
+    hand the pages at physical `start` to a device
+
+    `read(address, size)` returns an unsigned number, and
+    `write(address, size, value)` stores one, either defaulting to
+    a device that reads as zero and ignores writes.
+    '''
+    device = (start, start + length, read or (lambda address, size: 0),
+              write or (lambda address, size, value: None))
+    for number in range(start >> PAGE_SHIFT,
+                        ((start + length - 1) >> PAGE_SHIFT) + 1):
+        MMIO[number] = device
+
+def uart_write(address, size, value):
+    '''
+    echo bytes written to the transmit register of a console UART
+    '''
+    sys.stdout.write(chr(value & 0xff))
+    sys.stdout.flush()
+
+
+def translate(pc):
+    '''
+    decode the word at address `pc` to a handler bound to its operands
+    '''
+    memory = page(physical(pc), allocate=False)
+    if memory is None:  # code only runs from memory already written
+        raise Trap('no code at address 0x%08x' % pc)
+    instruction = struct.unpack_from('<L', memory, pc & PAGE_MASK)[0]
+    CODE_LINES[physical(pc) >> CODE_LINE].add(pc)
+    decoded = decode_instruction(instruction)
+    name = decoded[0]  # prefer a pseudo-op's own emulation, such as `move`
+    if name not in OPERANDS or name == '.word':
+        name = decoded[-1]
+    if name not in OPERANDS or name == '.word' or name in UNIMPLEMENTED:
+        if UNKNOWN == 'raise':
+            raise NotImplementedError('No known way to execute %s' % name)
+        return partial(mips_unknown, pc, instruction)
+    args = [pc, STATE['hi'], STATE['lo']]
+    for field, shift, mask, kind in OPERANDS[name]:
+        number = (instruction >> shift) & mask
+        if kind == 'register':
+            args.append(Register.registers[number])
+        elif kind == 'coregister':
+            args.append(CoprocessorRegister.registers[0][number])
+        else:
+            args.append(number)
+    if __debug__ and 'emulate' in TRACE:
+        logging.debug('translated 0x%08x: %s %s', pc, name, args)
+    return partial(EMULATION[name], *args)
+
+def encoder(name, fields):
+    '''
+    precompute the assembly of an instruction from its REFERENCE fields
+
+    Returns the fixed bits and the variable fields as from operands().
+
+    >>> base, fields = encoder('addu', REFERENCE['addu']['fields'])
+    >>> hex(base), [field[:2] for field in fields]
+    ('0x21', [('rs', 21), ('rt', 16), ('rd', 11)])
+    '''
+    base, shift = 0, 32
+    for field, bits in fields:
+        shift -= len(bits)
+        if bits.isdigit():
+            base |= int(bits, 2) << shift
+    return base, operands(name, fields)
+
+def operands(name, fields):
+    '''
+    list (field, shift, mask, kind) for the variable fields of an instruction
+
+    >>> operands('addiu', REFERENCE['addiu']['fields'])
+    [('rs', 21, 31, 'register'), ('rt', 16, 31, 'register'), \
+('immediate', 0, 65535, 'number')]
+    '''
+    result = []
+    shift = 32
+    coprocessor = fields[0][0].startswith('COP')
+    for field, bits in fields:
+        shift -= len(bits)
+        if bits.isdigit():
+            continue
+        if field in ('rs', 'rt', 'rd', 'base'):
+            if field == 'rt' and re.match('[LS][WD]C[0-3]$', fields[0][0]):
+                kind = 'number'  # coprocessor register, such as lwc1's ft
+            elif not coprocessor or field == 'rt':
+                kind = 'register'
+            elif fields[0][0] == 'COP0':
+                kind = 'coregister'
+            else:
+                kind = 'number'
+        else:
+            kind = 'number'
+        result.append((field, shift, (1 << len(bits)) - 1, kind))
+    return result
+
+def mips_signed(value, bits=32):
+    '''
+    interpret the low `bits` of a number as two's complement
+
+    >>> mips_signed(0xfffffffe), mips_signed(0x7fff, 16)
+    (-2, 32767)
+    >>> mips_signed(0x8000, 16)
+    -32768
+    '''
+    sign = SIGN_BIT[bits]
+    if value < sign:
+        if value >= -sign:
+            return value
+    elif value < sign << 1:
+        return value - (sign << 1)
+    value &= (sign << 1) - 1  # slow, but rarely needed
+    return value - (sign << 1) if value >= sign else value
+
+def mips_branch(pc, offset, taken=True, likely=False):
+    '''
+    branch, after the delay slot, relative to the instruction following `pc`
+
+    A "likely" branch not taken skips its delay slot instead.
+    '''
+    if taken:
+        CPU['jump'] = (pc + 4 + (mips_signed(offset, 16) << 2)) & 0xffffffff
+    elif likely:
+        CPU['nullify'] = True
+
+def mips_jump(address):
+    '''
+    jump, after the delay slot, to an absolute address
+    '''
+    CPU['jump'] = int(address) & 0xffffffff
+
+def mips_break(codehi=0, codelo=0):
+    '''
+    breakpoint, which stops the emulator
+    '''
+    raise Trap('break %d, %d' % (codehi, codelo))
+
+def mips_syscall(code=0):
+    '''
+    system call, which with no operating system stops the emulator
+    '''
+    raise Trap('syscall %d' % code)
+
+def mips_trap(code=0):
+    '''
+    conditional trap, which stops the emulator
+    '''
+    raise Trap('trap %d' % code)
 
 def mips_add(augend, addend, bits=32, ignore_overflow=False):
     '''
-    Add a number to a MIPS register
+    Add two numbers as a MIPS register would, returning a signed result
 
-    MIPS always uses 32 or 64 bit integers.
+    MIPS always uses 32 or 64 bit integers, and its "unsigned" operations
+    are actually signed, but simply ignore arithmetic overflow. Operands
+    are 32-bit register contents, sign-extended for 64-bit operations.
 
-    Its "unsigned" operations are actually signed, but simply ignore
-    arithmetic overflow.
+    >>> mips_add(0x7fffffff, 1, ignore_overflow=True), mips_add(-1, -1)
+    (-2147483648, -2)
+    >>> mips_add(0x7fffffff, 1)
+    Traceback (most recent call last):
+        ...
+    mips.ArithmeticOverflow: MIPS sum 0x80000000 overflows 32 bits
     '''
-    c_int = c_int32 if bits == 32 else c_int64
-    adder = c_int(augend)
-    adder.value += int(addend)
-    total = adder.value  # I'd use `sum` but it's bad practice
+    if not -0x80000000 <= augend < 0x80000000:
+        augend = mips_signed(augend)
+    if not -0x80000000 <= addend < 0x80000000:
+        addend = mips_signed(addend)
+    total = augend + addend
+    sign = SIGN_BIT[bits]
+    if -sign <= total < sign:
+        return total
     if not ignore_overflow:
-        check_sum = augend.value + addend  # check using Python's bignums
-        if total != check_sum:
-            raise ArithmeticOverflow('MIPS sum %s != Python sum %s' %
-                                     (hex(total), hex(check_sum)))
-    return total
- 
+        raise ArithmeticOverflow('MIPS sum %s overflows %d bits' %
+                                 (hex(total), bits))
+    return mips_signed(total, bits)
+
 def mips_subtract(subtrahend, minuend, bits=32, ignore_overflow=False):
     '''
-    Subtract a number from a MIPS register
-    
-    MIPS always uses 32 or 64 bit integers.
+    Subtract a number from another as a MIPS register would
 
-    Its "unsigned" operations are actually signed, but simply ignore
-    arithmetic overflow.
+    >>> mips_subtract(0, 1), mips_subtract(0x80000000, 1, 32, True)
+    (-1, 2147483647)
+    >>> mips_subtract(0, 0x80000000)
+    Traceback (most recent call last):
+        ...
+    mips.ArithmeticOverflow: MIPS difference 0x80000000 overflows 32 bits
     '''
-    return mips_add(subtrahend, -minuend, bits, ignore_overflow)
+    if not -0x80000000 <= subtrahend < 0x80000000:
+        subtrahend = mips_signed(subtrahend)
+    if not -0x80000000 <= minuend < 0x80000000:
+        minuend = mips_signed(minuend)
+    difference = subtrahend - minuend
+    sign = SIGN_BIT[bits]
+    if -sign <= difference < sign:
+        return difference
+    if not ignore_overflow:
+        raise ArithmeticOverflow('MIPS difference %s overflows %d bits' %
+                                 (hex(difference), bits))
+    return mips_signed(difference, bits)
 
 def mips_multiply(multiplicand, multiplier, bits=32, unsigned=False,
         return_as_int=False):
     '''
-    Multiply a number to a MIPS register
+    Multiply two MIPS registers
 
-    MIPS always uses 32 or 64 bit integers.
+    MIPS multiplication always ignores overflow, but has signed and
+    unsigned variants.
 
-    Most of its "unsigned" operations are actually signed, but simply ignore
-    arithmetic overflow. MIPS multiplication always ignores overflow, but has
-    signed and unsigned variants.
+    When `return_as_int` is True, the low half of the product is returned
+    as a single integer. Otherwise, it's returned as a tuple for the
+    (hi, lo) special registers.
 
-    When `return` is True, the product is returned as a single 32-bit integer.
-    Otherwise, it's still returned, but as a tuple for the (hi, lo) special
-    registers.
+    See https://devblogs.microsoft.com/oldnewthing/20180404-00/?p=98435
+
+    >>> [hex(half) for half in mips_multiply(-2, 3)]
+    ['0xffffffff', '0xfffffffa']
+    >>> [hex(half) for half in mips_multiply(-2, 3, unsigned=True)]
+    ['0x2', '0xfffffffa']
+    >>> mips_multiply(-2, 3, return_as_int=True)
+    -6
+    '''
+    multiplicand = mips_signed(multiplicand)
+    multiplier = mips_signed(multiplier)
+    if unsigned:
+        multiplicand &= MASK[bits]
+        multiplier &= MASK[bits]
+    product = multiplicand * multiplier
+    if return_as_int:
+        return mips_signed(product, bits)
+    return (product >> bits) & MASK[bits], product & MASK[bits]
+
+def mips_div(dividend, divisor, bits=32, unsigned=False):
+    '''
+    Divide two MIPS registers, returning (quotient, remainder) for (lo, hi)
+
+    Division is exceptional because it cannot overflow. The quotient is
+    truncated toward zero, as in C, and division by zero, for which MIPS
+    leaves the result unpredictable, gives a quotient of 0.
 
     See https://devblogs.microsoft.com/oldnewthing/20180404-00/?p=98435
+
+    >>> mips_div(-7, 2), mips_div(-7, 2, unsigned=True)
+    ((-3, -1), (2147483644, 1))
     '''
-    c_int = eval('c_int%du' % bits) if unsigned else eval('c_int%d' % bits)
-    register = c_int(multiplicand)
-    register.value *= multiplier
-    product = register.value
-    return product if return_as_int else divmod(product, 1 << bits)
- 
-def mips_div(dividend, divisor, bits=32, ignore_overflow=False):
+    dividend, divisor = mips_signed(dividend), mips_signed(divisor)
+    if unsigned:
+        dividend &= MASK[bits]
+        divisor &= MASK[bits]
+    if divisor == 0:
+        return 0, dividend
+    quotient = abs(dividend) // abs(divisor)
+    if (dividend < 0) != (divisor < 0):
+        quotient = -quotient
+    return quotient, dividend - quotient * divisor
+
+def mips_load(base, offset, size=4, signed=True):
     '''
-    Divide a MIPS register by a number
+    load a number of `size` bytes from `base` + signed 16-bit `offset`
 
-    MIPS always uses 32 or 64 bit integers.
+    Eight bytes are loaded whole, but only fit a register if the number
+    is a sign-extended 32-bit one, as a MIPS32 program would have stored.
 
-    Most of its "unsigned" operations are actually signed, but simply ignore
-    arithmetic overflow. Division is exceptional because it cannot overflow.
+    >>> written = mips_store(0x89abcdef, 0x80001000, 0)
+    >>> hex(mips_load(0x80001000, 0)), mips_load(0x80001004, 0xfffc, 2)
+    ('-0x76543211', -12817)
+    >>> mips_load(0x80001000, 3, 1, False)
+    137
+    '''
+    address = physical(base + mips_signed(offset, 16))
+    if address & (size - 1):
+        raise Trap('address error loading 0x%08x' % address)
+    number = address >> PAGE_SHIFT
+    memory = MEMORY.get(number)
+    if memory is None or number in MMIO:
+        return int.from_bytes(read_memory(address, size), 'little',
+                              signed=signed)
+    return LOAD[size, signed](memory, address & PAGE_MASK)[0]
 
-    See https://devblogs.microsoft.com/oldnewthing/20180404-00/?p=98435
+def mips_store(value, base, offset, size=4):
+    '''
+    store `value` as `size` bytes at `base` + signed 16-bit `offset`
+
+    Eight bytes store `value` sign-extended from 32 bits.
+    '''
+    address = physical(base + mips_signed(offset, 16))
+    if address & (size - 1):
+        raise Trap('address error storing 0x%08x' % address)
+    CPU['store'] = address, value, size  # for tracing
+    number = address >> PAGE_SHIFT
+    memory = MEMORY.get(number)
+    if (memory is None or number in MMIO
+            or address >> CODE_LINE in CODE_LINES):
+        if size == 8:
+            value = mips_signed(value)
+        return write_memory(address, (value & STORE_MASK[size]).to_bytes(
+            size, 'little'))
+    if size == 8:
+        value = mips_signed(value)
+    STORE[size](memory, address & PAGE_MASK, value & STORE_MASK[size])
+    return size
+
+def mips_lwl(value, base, offset):
+    '''
+    merge the bytes up to an unaligned address into the top of `value`
+
+    Little-endian, so for `lwl rt, 3(base)` following `lwr rt, 0(base)`.
+
+    >>> written = write_memory(0x80002000, bytes(range(8)))
+    >>> hex(mips_lwl(0x11223344, 0x80002000, 4))
+    '0x4223344'
+    >>> hex(mips_lwr(mips_lwl(0, 0x80002000, 5), 0x80002000, 2))
+    '0x5040302'
+    '''
+    address = base + mips_signed(offset, 16)
+    shift = (3 - (address & 3)) << 3
+    word = mips_load(address & ~3, 0, 4, False)
+    return ((word << shift) & 0xffffffff) | (value & ((1 << shift) - 1))
+
+def mips_lwr(value, base, offset):
+    '''
+    merge the bytes from an unaligned address into the bottom of `value`
+    '''
+    address = base + mips_signed(offset, 16)
+    shift = (address & 3) << 3
+    word = mips_load(address & ~3, 0, 4, False)
+    return (word >> shift) | (value & ~(0xffffffff >> shift))
+
+def mips_swl(value, base, offset):
+    '''
+    store the top of `value` in the bytes up to an unaligned address
+
+    >>> written = write_memory(0x80003000, bytes(8))
+    >>> stored = mips_swr(0x44332211, 0x80003000, 2)
+    >>> stored = mips_swl(0x44332211, 0x80003000, 5)
+    >>> read_memory(0x80003000, 8)
+    b'\\x00\\x00\\x11"3D\\x00\\x00'
+    '''
+    address = base + mips_signed(offset, 16)
+    shift = (3 - (address & 3)) << 3
+    word = mips_load(address & ~3, 0, 4, False)
+    word = (word & ~(0xffffffff >> shift)) | ((value & 0xffffffff) >> shift)
+    return mips_store(word, address & ~3, 0)
+
+def mips_swr(value, base, offset):
+    '''
+    store the bottom of `value` in the bytes from an unaligned address
+    '''
+    address = base + mips_signed(offset, 16)
+    shift = (address & 3) << 3
+    word = mips_load(address & ~3, 0, 4, False)
+    word = (word & ((1 << shift) - 1)) | ((value << shift) & 0xffffffff)
+    return mips_store(word, address & ~3, 0)
+
+def mips_coprocessor_load(coprocessor, register, base, offset, size=4):
+    '''
+    load coprocessor `register`, or with 8 bytes an even-odd pair of them
+    '''
+    index = COPROCESSOR_REGISTERS + (coprocessor << 5) + register
+    address = base + mips_signed(offset, 16)
+    for word in range(size >> 2):
+        REGFILE[index + word] = mips_load(address + (word << 2), 0, 4, False)
+
+def mips_coprocessor_store(coprocessor, register, base, offset, size=4):
+    '''
+    store coprocessor `register`, or with 8 bytes an even-odd pair of them
+    '''
+    index = COPROCESSOR_REGISTERS + (coprocessor << 5) + register
+    address = base + mips_signed(offset, 16)
+    for word in range(size >> 2):
+        mips_store(REGFILE[index + word], address + (word << 2), 0)
+
+def mips_unknown(pc, instruction):
+    '''
+    instruction with no emulation, trapping or ignored as UNKNOWN says
     '''
-    c_int = c_uint32 if bits == 32 else c_uint64
-    register = c_int(dividend)
-    quotient, remainder = divmod(register.value, divisor)
-    return quotient, remainder
- 
-def mips_lw(rt, offset, base, half='both'):
-    '''
-    Load 32-bit register 'rt' from memory. Supports 'lw', 'lwl', and 'lwr'.
-    '''
-    register = c_int32(base)
-    register.value += offset
-    loadoffset = register.value % 4
-    length = 4 - loadoffset
-    if half == 'left':
-        rt.bytevalue = (MEMORY[offset:offset + length + 1], 0)
-    elif half == 'right':
-        rt.bytevalue = (MEMORY[offset + length:offset + 4], length)
-    else:  # both
-        rt.bytevalue = (MEMORY[offset:offset + 4], 0)
+    if UNKNOWN != 'skip':
+        raise Trap('no emulation for 0x%08x' % instruction)
+    logging.info('skipping 0x%08x at 0x%08x', instruction, pc)
+
+def mips_reserved(mnemonic):
+    '''
+    reserved instruction, such as one needing 64-bit registers
+    '''
+    raise Trap('reserved instruction %s' % mnemonic)
 
 def mips_mfc0(rd, selector):
     '''
     Return contents of coprocessor 0 register rd with selector
+
+    Only selector 0 of each register is kept, the others reading as zero.
+
+    >>> status = CoprocessorRegister.registers[0]['c0_sr']
+    >>> mips_mtc(0, status, 0, 0x10000001)
+    >>> hex(mips_mfc0(status, 0)), mips_mfc0(status, 1)
+    ('0x10000001', 0)
+    >>> mips_mtc(0, status, 0, 0)
     '''
+    return rd.value if selector == 0 else 0
 
-if __name__ == '__main__':
+def mips_mtc(coprocessor, rd, selector, value):
+    '''
+    move `value` to register rd with selector of a coprocessor
+
+    As for mips_mfc0(), writes to selectors other than 0 are ignored.
+    '''
+    if selector == 0:
+        rd.value = value
+
+def serve(socketpath=SOCKET):
+    '''
+    run SERVICES for clients connecting to a Unix socket
+
+    The tables are initialized once, so each request costs only its own
+    work. A request is a line of JSON: a list of the client's working
+    directory, the command, and its args and options as for mips.py. The
+    reply is a SERVICE_REPLY header, then what the command printed, or
+    the error. A client may send any number of requests, which are
+    answered in turn; see mipsclient.py. A socket left at `socketpath` by
+    a server that has gone is replaced, but anything else there is not.
+    '''
     init()
-    eval(COMMAND)(*ARGV)
-else:
+    labels = dict(LABELS)
+    if os.path.lexists(socketpath):
+        if not stat.S_ISSOCK(os.lstat(socketpath).st_mode):
+            raise FileExistsError('%s is in the way of the socket'
+                                  % socketpath)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socketpath)
+            except ConnectionRefusedError:
+                os.unlink(socketpath)  # left by a server that has gone
+            else:
+                raise FileExistsError('%s is already being served'
+                                      % socketpath)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)  # only this user may connect, even in /tmp
+    try:
+        server.bind(socketpath)
+    finally:
+        os.umask(umask)
+    server.listen()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())  # to clean up
+    logging.warning('serving %s on %s', ', '.join(SERVICES), socketpath)
+    try:
+        while True:
+            connection = server.accept()[0]
+            with connection, connection.makefile('rb') as requests:
+                for request in requests:
+                    status, reply = service(request, labels)
+                    connection.sendall(SERVICE_REPLY.pack(status, len(reply))
+                                       + reply)
+    finally:
+        server.close()
+        os.unlink(socketpath)
+
+def service(request, labels):
+    '''
+    run one request for serve(), returning status and what was printed
+
+    LABELS is reset to `labels`, as after init(), so one disassembly
+    does not leave its labels in the next.
+    '''
+    try:
+        directory, command, *args = json.loads(request)
+        if command not in SERVICES:
+            raise ValueError('%r is not one of %s' % (command, SERVICES))
+        os.chdir(directory)
+        args, options = cliargs(args)
+        LABELS.clear()
+        LABELS.update(labels)
+        output = io.TextIOWrapper(io.BytesIO(), write_through=True)
+        sys.stdout, stdout = output, sys.stdout
+        try:
+            globals()[command](*args, **options)
+        finally:
+            sys.stdout = stdout
+        return 0, output.detach().getvalue()
+    except Exception as problem:
+        logging.error('%s failed: %s',
+                      request.decode(errors='replace').strip(), problem)
+        return 1, ('%s: %s' % (type(problem).__name__, problem)).encode()
+
+def cliargs(args):
+    '''
+    separate `--name value` or `--name=value` options from the positional
+    args of COMMAND
+
+    >>> cliargs(['0.dat', '--jobs', '4', '--end=0x100'])
+    (['0.dat'], {'jobs': '4', 'end': '0x100'})
+    '''
+    positional, options = [], {}
+    args = iter(args)
+    for arg in args:
+        if arg.startswith('--'):
+            name, equals, value = arg[2:].partition('=')
+            if not equals:
+                try:
+                    value = next(args)
+                except StopIteration:
+                    raise ValueError('No value given for option %s' % arg)
+            options[name.replace('-', '_')] = value
+        else:
+            positional.append(arg)
+    return positional, options
+
+def main(argv=None):
+    '''
+    command line: run the function named by the first arg with the rest
+
+    Logging is set up here rather than on import, so as not to change
+    that of programs importing this module.
+    '''
+    logging.basicConfig(level=logging.DEBUG if __debug__ else logging.WARN)
+    logging.warning('USE_LABELS = %s, AGGRESSIVE_WORDING=%s', USE_LABELS,
+                    AGGRESSIVE_WORDING)
+    try:
+        command, *args = sys.argv[1:] if argv is None else argv
+    except ValueError:
+        raise ValueError('Must specify command and args for that function')
     init()
+    args, options = cliargs(args)
+    eval(command)(*args, **options)
+
+if __name__ == '__main__':
+    main()
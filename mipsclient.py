@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+'''
+Thin client for `mips.py serve`, sparing each call the startup of mips.py
+
+Use it as mips.py, for the commands that serve() offers:
+
+    mipsclient.py disassemble 0.dat > 0.asm
+
+Several commands can be sent at once, separated by `+`, each writing to
+the file given with `--output` rather than to stdout:
+
+    mipsclient.py assemble 0.asm --output 0.img + assemble 1.asm --output 1.img
+'''
+# pylint disable=multiple-imports
+import sys, os, json, socket, struct
+
+SOCKET = os.getenv('MIPS_SOCKET', os.path.join(
+    os.getenv('XDG_RUNTIME_DIR') or '/tmp', 'mips-%d.sock' % os.getuid()))
+SERVICE_REPLY = struct.Struct('<BL')  # as in mips.py
+
+def request(args):
+    '''
+    run commands on the server, returning the exit status
+    '''
+    batch = commands(args)
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(SOCKET)
+    with connection, connection.makefile('rb') as replies:
+        connection.sendall(b''.join(
+            json.dumps([os.getcwd()] + command).encode() + b'\n'
+            for command, output in batch))
+        connection.shutdown(socket.SHUT_WR)
+        failed = 0
+        for command, output in batch:
+            status, length = SERVICE_REPLY.unpack(
+                replies.read(SERVICE_REPLY.size))
+            reply = replies.read(length)
+            if status:
+                print(' '.join(command), 'failed:', reply.decode(),
+                      file=sys.stderr)
+                failed = 1
+            elif output:
+                with open(output, 'wb') as outfile:
+                    outfile.write(reply)
+            else:
+                sys.stdout.buffer.write(reply)
+    return failed
+
+def commands(args):
+    '''
+    split args on `+` into commands and the --output of each, if any
+
+    >>> commands(['assemble', '0.asm', '--output', '0.img', '+', 'x'])
+    [(['assemble', '0.asm'], '0.img'), (['x'], None)]
+    '''
+    batch, command, output = [], [], None
+    args = iter(args + ['+'])
+    for arg in args:
+        if arg == '+':
+            batch.append((command, output))
+            command, output = [], None
+        elif arg == '--output':
+            output = next(args)
+        else:
+            command.append(arg)
+    return batch
+
+if __name__ == '__main__':
+    sys.exit(request(sys.argv[1:]))
@@ -6,7 +6,7 @@ information from //dr-emann.github.io/squashfs/
 and, for 3.0, //github.com/plougher/squashfs-tools/squashfs-tools/squashfs_fs.h,
 checkout tag 3.1
 '''
-import sys, os, struct, lzma, gzip, zlib, logging
+import sys, os, struct, lzma, gzip, zlib, logging, mmap
 from datetime import datetime
 from collections import OrderedDict
 
@@ -53,15 +53,16 @@ def unsquash(filespec):
     uncompress the entire filesystem
     '''
     with open(filespec, 'rb') as infile:
-        filedata = infile.read()
+        filedata = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
     header = OrderedDict()
     offset = 0
     for name, count, packformat in HEADER_SPEC:
         logging.debug('processing %s in header', [name, count, packformat])
-        value = chunk = filedata[offset:offset + count]
-        logging.debug('chunk: %r', chunk)
         if packformat:
-            value = struct.unpack(packformat, chunk)[0]
+            value = struct.unpack_from(packformat, filedata, offset)[0]
+        else:
+            value = filedata[offset:offset + count]
+        logging.debug('value: %r', value)
         if name in TRANSFORM:
             header[name] = eval(TRANSFORM[name])(value)
         else:
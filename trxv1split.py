@@ -6,7 +6,7 @@ Tested only with an older OpenWrt CFE partition image.
 Using Python3 for native lzma support
 '''
 # pylint disable=multiple-imports
-import sys, os, re, subprocess, logging, lzma, gzip, zlib
+import sys, os, re, subprocess, logging, lzma, gzip, zlib, mmap
 from socket import ntohl
 
 logging.basicConfig(level=logging.DEBUG if __debug__ else logging.WARN)
@@ -41,7 +41,9 @@ def split(filespec, outdir=None):
         logging.warning('Output goes to %s', dirname)
     os.mkdir(dirname)  # raises OSError if already exists
     with open(filespec, 'rb') as infile:
-        filedata = infile.read()
+        # slices of a memoryview on the mapped file are not copies
+        filedata = memoryview(mmap.mmap(infile.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
     parts.append([str(len(filedata))])
     logging.debug('parts: %s', parts)
     for index in range(len(parts) - 1):
@@ -63,9 +65,10 @@ def split(filespec, outdir=None):
             trx_header = description.split()
             crc32 = trx_header[trx_header.index('CRC32:') + 1].rstrip(',')
             trxsize = int(trx_header[trx_header.index('size:') + 1].rstrip(','))
+            checked = filedata[12:trxsize]
             logging.debug('calculating CRC32 on %d (0x%x) bytes of data',
-                          len(filedata[12:trxsize]), len(filedata[12:trxsize]))
-            crc32_check = zlib.crc32(filedata[12:trxsize])
+                          len(checked), len(checked))
+            crc32_check = zlib.crc32(checked)
             if int(crc32, 16) != crc32_check ^ 0xffffffff:
                 raise ValueError('Nonmatching CRCs 0x%x != %s' %
                                  (crc32_check, crc32.lower()))
@@ -102,7 +105,7 @@ def decompress(compression, filedata, hexoffset, end):
     offset = int(hexoffset, 16)
     data = filedata[offset:end]
     logging.debug('decompressing %d bytes of %s data from offset 0x%x: %r...',
-                  end - offset, module, offset, data[:16])
+                  end - offset, module, offset, bytes(data[:16]))
     return eval(module).decompress(data)
 
 def writefile(dirname, hexoffset, extension, mode, end, filedata, offsets):